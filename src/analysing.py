@@ -0,0 +1,315 @@
+
+import time
+
+import numpy as np
+import scipy.sparse as sp
+
+from scipy.sparse import csgraph
+from scipy.sparse.linalg import svds, ArpackNoConvergence
+
+from graphing import graph_load
+
+# results {{{
+
+class keyed:
+    """
+    An array of `values`, one per node of `compact_graph` `graph`, indexed by A-number.
+    """
+
+    def __init__(self, graph, values):
+        self.graph = graph
+        self.values = values
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, seq_ids):
+        if isinstance(seq_ids, str):
+            return self.values[self.graph.nodes_of([seq_ids])[0]]
+        return self.values[self.graph.nodes_of(seq_ids)]
+
+    def __array__(self, dtype=None, copy=None):
+        return self.values if dtype is None else self.values.astype(dtype)
+
+    def items(self):
+        return zip(self.graph.ids.tolist(), self.values.tolist())
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def top(self, k=10):
+        """
+        Return the list of pairs `(seq_id, value)` of the `k` greatest values.
+        """
+        nodes = np.argsort(-self.values, kind='stable')[:k]
+        return list(zip(self.graph.ids[nodes].tolist(), self.values[nodes].tolist()))
+
+# }}}
+
+# matrices {{{
+
+def adjacency_matrix(graph, dtype=np.float64):
+    """
+    Return the sparse matrix of `compact_graph` `graph`, whose entry `(i, j)` is 1
+    if node `i` references node `j`.
+    """
+    n = len(graph)
+    A = sp.csr_matrix((np.ones(graph.number_of_edges(), dtype=dtype), graph.indices, graph.indptr), shape=(n, n))
+    A.sum_duplicates()
+    A.data[:] = 1
+    return A
+
+def undirected_matrix(graph, self_loops=True):
+    """
+    Return the symmetric sparse matrix of `compact_graph` `graph`, forgetting directions.
+    """
+    A = adjacency_matrix(graph)
+    U = (A + A.T).tocsr()
+    U.data[:] = 1
+    if not self_loops:
+        U.setdiag(0)
+        U.eliminate_zeros()
+    return U
+
+# }}}
+
+# rankings {{{
+
+def pagerank(graph, alpha=0.85, max_iter=100, tol=1.0e-06):
+    """
+    Return the PageRank of nodes of `compact_graph` `graph`, by power iteration,
+    whose dangling nodes link every node; as `networkx.pagerank`, iterations stop
+    when the l1 change is below `len(graph) * tol`, raising `ArithmeticError`
+    after `max_iter` ones.
+    """
+    n = len(graph)
+    if not n: return keyed(graph, np.zeros(0))
+
+    A = adjacency_matrix(graph)
+    out_degrees = np.asarray(A.sum(axis=1)).ravel()
+    dangling = out_degrees == 0
+    P = (sp.diags(1.0 / np.where(dangling, 1, out_degrees)) @ A).T.tocsr()
+
+    x = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        previous = x
+        x = alpha * (P @ x + x[dangling].sum() / n) + (1 - alpha) / n
+        if np.abs(x - previous).sum() < n * tol:
+            return keyed(graph, x)
+
+    raise ArithmeticError('pagerank: power iteration failed to converge in {} iterations'.format(max_iter))
+
+def hits(graph, max_iter=None, tol=1.0e-08):
+    """
+    Return the pair of hub and authority scores of nodes of `compact_graph` `graph`,
+    each summing to 1; as `networkx.hits`, authorities are the leading right
+    singular vector of the adjacency matrix, computed by ARPACK with `max_iter`
+    iterations (its own default if `None`) and tolerance `tol`, and hubs are
+    authorities they reference. Raise `ArithmeticError` if ARPACK doesn't converge.
+    """
+    n = len(graph)
+    if n < 2: return keyed(graph, np.ones(n)), keyed(graph, np.ones(n))
+
+    A = adjacency_matrix(graph)
+    if not A.nnz: return keyed(graph, np.full(n, 1.0 / n)), keyed(graph, np.full(n, 1.0 / n))
+
+    try:
+        _, _, vt = svds(A, k=1, maxiter=max_iter, tol=tol)
+    except ArpackNoConvergence:
+        raise ArithmeticError('hits: singular vectors failed to converge in {} iterations'.format(max_iter))
+
+    # of a single sign, unless the leading singular value is repeated (as in trees)
+    authorities = np.abs(vt.ravel().real)
+    hubs = A @ authorities
+    return (keyed(graph, hubs / hubs.sum()),
+            keyed(graph, authorities / authorities.sum()))
+
+# }}}
+
+# structure {{{
+
+def connected_components(graph, strong=False):
+    """
+    Return the number of components of `compact_graph` `graph` and the component
+    of each node, labelled by integers; components are weak unless `strong` is true.
+    """
+    count, labels = csgraph.connected_components(adjacency_matrix(graph), directed=True,
+                                                 connection='strong' if strong else 'weak')
+    return count, keyed(graph, labels)
+
+def strongly_connected_components(graph):
+    return connected_components(graph, strong=True)
+
+def core_numbers(graph):
+    """
+    Return the core number of each node of `compact_graph` `graph`, forgetting
+    directions and self loops: the greatest `k` such that the node belongs to a
+    subgraph whose nodes have `k` neighbours at least.
+
+    Peeling removes every node of degree `k` at most at once, with a sparse product
+    updating degrees of their neighbours, rather than one node at a time.
+    """
+    U = undirected_matrix(graph, self_loops=False)
+    degrees = np.asarray(U.sum(axis=1)).ravel().astype(np.int64)
+    cores = np.zeros(len(graph), dtype=np.int64)
+    remaining = np.ones(len(graph), dtype=bool)
+
+    k = 0
+    while remaining.any():
+        k = max(k, degrees[remaining].min())
+        peeled = remaining & (degrees <= k)
+        while peeled.any():
+            cores[peeled] = k
+            remaining &= ~peeled
+            degrees -= (U @ peeled.astype(np.int64)).astype(np.int64)
+            peeled = remaining & (degrees <= k)
+
+    return keyed(graph, cores)
+
+def bfs_distances(graph, seeds, directed=True):
+    """
+    Return the number of references to follow from the nearest sequence among
+    `seeds` to reach each node of `compact_graph` `graph`, -1 for unreachable
+    ones; references are followed both ways unless `directed` is true.
+
+    A single search starts from an extra node referencing every seed.
+    """
+    n = len(graph)
+    sources = graph.nodes_of(seeds)
+    source = sp.csr_matrix((np.ones(len(sources)), sources, [0, len(sources)]), shape=(1, n))
+    A = sp.bmat([[adjacency_matrix(graph), sp.csr_matrix((n, 1))], [source, sp.csr_matrix((1, 1))]], format='csr')
+
+    lengths = csgraph.shortest_path(A, directed=directed, unweighted=True, indices=n)[:n]
+    reached = np.isfinite(lengths)
+    distances = np.full(n, -1, dtype=np.int64)
+    distances[reached] = lengths[reached] - 1
+    return keyed(graph, distances)
+
+def degrees(graph, direction='total'):
+    """
+    Return the degree of each node of `compact_graph` `graph`, counting references
+    to it if `direction` is `in`, from it if `out`, both ways if `total`.
+    """
+    A = adjacency_matrix(graph)
+    incoming, outgoing = np.asarray(A.sum(axis=0)).ravel(), np.asarray(A.sum(axis=1)).ravel()
+    values = {'in': incoming, 'out': outgoing, 'total': incoming + outgoing}[direction]
+    return keyed(graph, values.astype(np.int64))
+
+def degree_distribution(graph, direction='total'):
+    """
+    Return the array whose `d`-th entry counts nodes of `degrees` `d`.
+    """
+    return np.bincount(degrees(graph, direction).values)
+
+# }}}
+
+# benchmarking {{{
+
+def canonical_labels(labels):
+    """
+    Relabel components by their first node, so that equal partitions have equal labels.
+    """
+    _, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    return first[inverse]
+
+def benchmark(graph, seeds, repeat=1):
+    """
+    Run each analysis on `compact_graph` `graph` and its networkx equivalent,
+    yielding tuples `(name, seconds, networkx_seconds, agreement)` where
+    `agreement` is the greatest difference of values, 0 for equal partitions.
+    """
+    import networkx as nx
+
+    def timed(f):
+        best, result = float('inf'), None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = f()
+            best = min(best, time.perf_counter() - start)
+        return best, result
+
+    def difference(values, mapping, missing=0):
+        other = np.array([mapping.get(n, missing) for n in graph.ids.tolist()], dtype=float)
+        return float(np.abs(np.asarray(values, dtype=float) - other).max(initial=0))
+
+    def partition(components):
+        labels = np.empty(len(graph), dtype=np.int64)
+        for label, component in enumerate(components):
+            labels[graph.nodes_of(sorted(component))] = label
+        return labels
+
+    ours, theirs = timed(lambda: adjacency_matrix(graph)), timed(lambda: graph.to_networkx(digraph=True))
+    yield 'graph building', ours[0], theirs[0], 0.0
+    G = theirs[1]
+    U = nx.Graph(G)
+    U.remove_edges_from(list(nx.selfloop_edges(U)))
+
+    ours, theirs = timed(lambda: pagerank(graph)), timed(lambda: nx.pagerank(G))
+    yield 'pagerank', ours[0], theirs[0], difference(ours[1], theirs[1])
+
+    ours, theirs = timed(lambda: hits(graph)), timed(lambda: nx.hits(G))
+    yield 'hits', ours[0], theirs[0], max(difference(ours[1][0], theirs[1][0]),
+                                          difference(ours[1][1], theirs[1][1]))
+
+    ours, theirs = timed(lambda: connected_components(graph)), timed(lambda: list(nx.weakly_connected_components(G)))
+    yield 'connected components', ours[0], theirs[0], difference(canonical_labels(ours[1][1].values),
+                                                                 dict(zip(graph.ids.tolist(), canonical_labels(partition(theirs[1])).tolist())))
+
+    ours, theirs = timed(lambda: strongly_connected_components(graph)), timed(lambda: list(nx.strongly_connected_components(G)))
+    yield 'strongly connected components', ours[0], theirs[0], difference(canonical_labels(ours[1][1].values),
+                                                                          dict(zip(graph.ids.tolist(), canonical_labels(partition(theirs[1])).tolist())))
+
+    ours, theirs = timed(lambda: core_numbers(graph)), timed(lambda: nx.core_number(U))
+    yield 'k-core decomposition', ours[0], theirs[0], difference(ours[1], theirs[1])
+
+    ours, theirs = timed(lambda: bfs_distances(graph, seeds)), timed(lambda: nx.multi_source_dijkstra_path_length(G, set(seeds)))
+    yield 'bfs distances', ours[0], theirs[0], difference(ours[1], theirs[1], missing=-1)
+
+    ours, theirs = timed(lambda: degree_distribution(graph)), timed(lambda: nx.degree_histogram(G))
+    yield 'degree distribution', ours[0], theirs[0], float(np.abs(ours[1] - np.array(theirs[1])).max(initial=0))
+
+# }}}
+
+# argument parsing {{{
+
+def handle_cli_arguments():
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='OEIS analyser.')
+
+    parser.add_argument('seeds', metavar='S', nargs='*', default=['A000045'],
+                        help='Sequence to measure BFS distances from, given in the form Axxxxxx (defaults to A000045)')
+    parser.add_argument("--cache-dir", help="Cache directory (defaults to ./fetched/)",
+                        default='./fetched/')
+    parser.add_argument("--top", metavar='K', help="Print the K sequences of greatest PageRank (defaults to 10)",
+                        default=10, type=int)
+    parser.add_argument("--benchmark", help="Compare timings and results against networkx (defaults to False)",
+                        action="store_true")
+    parser.add_argument("--repeat", metavar='N', help="Time each analysis as the best of N runs (defaults to 1)",
+                        default=1, type=int)
+
+    args = parser.parse_args()
+    return args
+
+# }}}
+
+# main {{{
+
+if __name__ == "__main__":
+
+    args = handle_cli_arguments()
+
+    graph = graph_load(args.cache_dir, compact=True)
+    print('{} sequences, {} references'.format(len(graph), graph.number_of_edges()))
+
+    for seq_id, rank in pagerank(graph).top(args.top):
+        print('{} {:.6f}'.format(seq_id, rank))
+
+    if args.benchmark:
+        print('{:<32}{:>12}{:>12}{:>10}{:>12}'.format('analysis', 'scipy', 'networkx', 'speedup', 'difference'))
+        for name, ours, theirs, difference in benchmark(graph, args.seeds, args.repeat):
+            print('{:<32}{:>11.4f}s{:>11.4f}s{:>9.1f}x{:>12.2g}'.format(name, ours, theirs, theirs / max(ours, 1e-9), difference))
+
+# }}}
+
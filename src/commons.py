@@ -1,5 +1,11 @@
 
-import re, requests, os, json
+import re, requests, os
+
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from indexing import cache_index
+from storing import response_cache, open_storage
 
 Axxxxxx_regex = re.compile('(?P<id>A\d{6,6})')
 
@@ -7,17 +13,117 @@ def cross_references(xref):
     return {r for references in xref for r in Axxxxxx_regex.findall(references)}
 
 def json_load(f, cache_dir, add_path_attr=True):
-    relative_path = os.path.join(cache_dir, f)
-    with open(relative_path, 'r') as handler:
-        doc = json.load(handler)
-        if add_path_attr:
-            doc['relative_path'] = relative_path
-        return doc
+    A_genid = 'Axxxxxx'
+    storage = open_storage(cache_dir)
+    seq_id = f[:len(A_genid)]
+    doc = storage.get(seq_id)
+    if add_path_attr:
+        doc['relative_path'] = storage.path_of(seq_id)
+    return doc
+
+def json_dump(doc, seq_id, cache_dir):
+    stamp = open_storage(cache_dir).put(seq_id, doc)
+    open_index(cache_dir).record(seq_id, doc, stamp)
+    return stamp.path
 
 def cache_reify(cache_dir):
-    A_genid = 'Axxxxxx'
-    return {json_file[:len(A_genid)]: json_load(json_file, cache_dir)  
-            for json_file in filter(lambda f: f.endswith('.json'), os.listdir(cache_dir))}
+    return {seq_id: json_load(seq_id, cache_dir) for seq_id in open_storage(cache_dir).ids()}
+
+_indexes = {}
+
+def open_index(cache_dir):
+    """
+    Return the `cache_index` of `cache_dir`, opening it once per process and
+    again if the cache has been migrated to another storage since.
+    """
+    key = os.path.abspath(cache_dir)
+    if key in _indexes and _indexes[key].storage is not open_storage(cache_dir):
+        _indexes.pop(key).close()
+    if key not in _indexes:
+        _indexes[key] = cache_index(cache_dir)
+    return _indexes[key]
+
+_session = None
+
+def session(pool_maxsize=10):
+    """
+    Return the HTTP session shared by this module, whose keep-alive connections are pooled.
+    """
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        _session.mount('https://', adapter)
+        _session.mount('http://', adapter)
+    return _session
+
+_responses = {}
+
+def open_responses(cache_dir=None):
+    """
+    Return the `response_cache` of `cache_dir` (a memory only one if `None`), opening it once per process.
+    """
+    key = os.path.abspath(cache_dir) if cache_dir else None
+    if key not in _responses:
+        _responses[key] = response_cache(cache_dir)
+    return _responses[key]
+
+class cache_view(Mapping):
+    """
+    A lazy, read-only mapping from A-numbers to the documents cached in `cache_dir`.
+
+    A document is parsed only when accessed and at most `maxsize` decoded
+    documents are kept around, evicting the least recently used one; hence,
+    iterating over a `cache_view` doesn't require the whole cache to fit in memory.
+    """
+
+    def __init__(self, cache_dir, maxsize=1024, add_path_attr=True):
+        self.cache_dir = cache_dir
+        self.maxsize = maxsize
+        self.add_path_attr = add_path_attr
+        self.index = open_index(cache_dir)
+        self.index.refresh()
+        self.decoded = OrderedDict()
+
+    def __getitem__(self, seq_id):
+        if seq_id in self.decoded:
+            self.decoded.move_to_end(seq_id)
+            return self.decoded[seq_id]
+
+        doc = self.index.lookup(seq_id)
+        if doc is None:
+            raise KeyError(seq_id)
+
+        if self.add_path_attr:
+            doc['relative_path'] = self.index.path_of(seq_id)
+
+        self.decoded[seq_id] = doc
+        if len(self.decoded) > self.maxsize:
+            self.decoded.popitem(last=False)
+
+        return doc
+
+    def __iter__(self):
+        return iter(self.index.ids())
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, seq_id):
+        return seq_id in self.index
+
+    def project(self, *fields):
+        """
+        Iterate over `(seq_id, {field: value, ...})` pairs, reading only `fields`
+        (for instance `'xref'`, `'keyword'` and `'data'`) and decoding no document at all.
+        """
+        return self.index.project(fields)
+
+    def terms(self, seq_id):
+        """
+        Return the parsed terms of sequence `seq_id` from the memory-mapped term store.
+        """
+        return self.index.terms[seq_id]
 
 def fetch_oeis_payload( dolocal, 
                         payload, 
@@ -34,44 +140,53 @@ def fetch_oeis_payload( dolocal,
 
         cache_dir = dolocal['cache_dir']
 
-        docs = cache_reify(cache_dir)
-        
         if 'id' in dolocal:
-            doc = docs.get(dolocal['id'], None)
+            doc = open_index(cache_dir).lookup(dolocal['id'], touch=True) or {}
+            if doc.get('partial', False): # from a bulk import, to be fetched in full
+                doc = {}
 
         elif 'seq' in dolocal:
-            seq = dolocal['seq']
-
-            def filtering(doc):
-                result = doc['results'][0] if doc['results'] else {'data': ''}
-                if isinstance(seq, list):
-                    looking = ','.join(map(str, seq))
-                    return looking in result['data'].replace(' ', '')
-                elif isinstance(seq, set):
-                    ints = set(map(int, result['data'].split(',')))
-                    return seq.issubset(ints)
-                return False
-
+            index = open_index(cache_dir)
             multiple_results = []
-            for d in filter(filtering, docs.values()):
-                multiple_results.extend(d.get('results', []))
-            doc = {'results': multiple_results}
+            for seq_id in index.search_terms(dolocal['seq']):
+                multiple_results.extend((index.lookup(seq_id) or {}).get('results', []))
+            if multiple_results: # otherwise, ask oeis.org since the cache could be too small
+                doc = {'results': multiple_results}
+
+        elif 'query' in dolocal:
+            index = open_index(cache_dir)
+            ranked = index.search_text(dolocal['query'],
+                                       start=int(payload.get('start', 0)),
+                                       max_results=dolocal.get('max_results', None))
+            if ranked: # otherwise, ask oeis.org since the cache could be too small
+                doc = {'results': [r for seq_id in ranked
+                                     for r in (index.lookup(seq_id, touch=True) or {}).get('results', [])]}
 
         elif dolocal.get('most_recents', None):
-            ordering = os.path.getatime if dolocal['most_recents'] == 'ACCESS' else os.path.getmtime
+            index = open_index(cache_dir)
+            start, max_results = int(payload.get('start', 0)), dolocal.get('max_results', None)
+            ranked = index.most_recents(by=dolocal['most_recents'],
+                                        k=start + max_results if max_results else None)
             multiple_results = []
-            for d in sorted(docs.values(), 
-                            key=lambda doc: ordering(doc['relative_path']),
-                            reverse=True):
+            for seq_id in ranked[start:]:
                 # even tough in a Axxxxxx.json file `results` 
                 # should be a list with exactly one object
-                multiple_results.extend(d.get('results', [])) 
+                multiple_results.extend((index.lookup(seq_id) or {}).get('results', []))
             doc = {'results': multiple_results}
 
+    # results of id lookups live in the cache itself, others in the response cache,
+    # which is read before going to the network unless `bypass_responses` is true,
+    # as it is by default when a fresh fetch is asked by a false `cache_first`
+    responses = open_responses(dolocal.get('cache_dir', None)) if 'id' not in dolocal else None
+    bypass_responses = dolocal.get('bypass_responses', not dolocal.get('cache_first', True))
+
+    if 'results' not in doc and responses and not bypass_responses:
+        doc = responses.get(payload) or {}
+
     if 'results' not in doc:
 
         try: 
-            GET_result = requests.get("https://oeis.org/search", params=payload,)
+            GET_result = session().get("https://oeis.org/search", params=payload,)
         except Exception as e: 
             return network_error_handler(e)
 
@@ -82,11 +197,9 @@ def fetch_oeis_payload( dolocal,
                 doc['results'] = []
 
             if 'id' in dolocal and 'cache_dir' in dolocal:
-                cache_dir = dolocal['cache_dir']
-                relative_path = os.path.join(cache_dir, dolocal['id']+'.json')
-                with open(relative_path, 'w') as f:
-                    json.dump(doc, f)
-                    f.flush()
+                json_dump(doc, dolocal['id'], dolocal['cache_dir'])
+            elif responses:
+                responses.put(payload, doc)
 
             if progress_indicator: 
                 print(progress_indicator, end='')
@@ -96,6 +209,46 @@ def fetch_oeis_payload( dolocal,
 
     return then(doc, GET_result) if callable(then) else doc
 
+def fetch_oeis_ids(ids, cache_dir, batch_size=10,
+                   network_error_handler=lambda exc, batch: None,
+                   progress_indicator='●'):
+    """
+    Fetch sequences `ids` in batches, one `id:A1|id:A2|...` search each, writing them in `cache_dir`.
+
+    OEIS pages results by 10, so batches that large need one round-trip each;
+    every result is split back into its own `Axxxxxx.json` document, as if it
+    had been asked alone. Return the set of ids that couldn't be fetched.
+    """
+    ids = list(dict.fromkeys(ids)) # dedup, preserving order
+    fetched = set()
+
+    for i in range(0, len(ids), batch_size):
+        batch = ids[i:i+batch_size]
+        payload = {'fmt': 'json', 'q': '|'.join('id:{}'.format(seq_id) for seq_id in batch), 'start': 0}
+
+        while True:
+            try:
+                GET_result = session().get("https://oeis.org/search", params=payload,)
+                doc = GET_result.json()
+            except Exception as e:
+                network_error_handler(e, batch)
+                break
+
+            results = doc.get('results', None) or []
+            for result in results:
+                seq_id = 'A{:06d}'.format(result['number'])
+                single = dict(doc, query='id:{}'.format(seq_id), count=1, start=0, results=[result])
+                json_dump(single, seq_id, cache_dir)
+                fetched.add(seq_id)
+                if progress_indicator:
+                    print(progress_indicator, end='', flush=True)
+
+            payload['start'] += len(results)
+            if not results or payload['start'] >= doc.get('count', 0):
+                break
+
+    return set(ids) - fetched
+
 def OEIS_sequenceid(seqid):
     if not Axxxxxx_regex.match(seqid):
         raise ValueError
@@ -1,12 +1,16 @@
 
-import socket, json, re, os, sys, logging, asyncio, time
+import socket, json, re, os, sys, logging, asyncio, heapq, random, zlib
 
 from contextlib import suppress
 from functools import wraps, partial
-from collections import namedtuple, deque
+from collections import namedtuple, deque, defaultdict, Counter
 from itertools import count
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from commons import Axxxxxx_regex, OEIS_sequenceid
+from commons import Axxxxxx_regex, OEIS_sequenceid, json_dump, open_index
+from storing import open_storage, frontier_journal, frontier_store, shard_of
+from indexing import digest, PROJECTED_FIELDS
+from measuring import registry, write_snapshot, write_snapshots, serve
 
 # preamble {{{
 logging.getLogger('asyncio').setLevel(logging.WARNING)
@@ -17,10 +21,13 @@ logger = logging.getLogger(__name__)
 Axxxxxx_regex = re.compile('(?P<id>A\d{6,6})')
 
 URL = namedtuple('URL', ['host', 'port', 'resource'])
-RestartingUrls = namedtuple('RestartingUrls', ['seen', 'fringe'])
+RestartingUrls = namedtuple('RestartingUrls', ['seen', 'fringe', 'dead'])
 
 loop = asyncio.get_event_loop()
 
+# counters, gauges and latency histograms of the crawl, see module `measuring`
+metrics = registry(prefix='oeis_crawler_')
+
 #}}}
 
 # reader, fetcher and crawler classes ________________________________________________________ {{{
@@ -38,72 +45,650 @@ class reader:
         if chunk:   return chunk
         else:       raise StopAsyncIteration
 
+class response:
+
+    def __init__(self, version, status, headers, body):
+        self.version = version
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        return connection != 'close' if self.version == 'HTTP/1.1' else connection == 'keep-alive'
+
+class connection:
+    """
+    A persistent HTTP/1.1 connection, able to pipeline requests: responses are
+    read back in order, framed by `Content-Length` or chunked encoding, and
+    gzip-encoded bodies are decompressed as their bytes arrive.
+
+    Connecting, sending and each read wait `timeout` seconds at most, raising
+    `asyncio.TimeoutError`; a server may forget a kept-alive connection silently.
+    """
+
+    def __init__(self, host, port, timeout=30.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = None
+        self.buffer = bytearray()
+        self.requests = 0
+        self.sent = deque() # times of requests waiting for their response
+        self.reusable = True
+
+    async def open(self):
+
+        self.sock = socket.socket()
+        self.sock.setblocking(False)
+
+        started = loop.time()
+        try:
+            await asyncio.wait_for(loop.sock_connect(self.sock, address=(self.host, self.port)), self.timeout)
+        except BaseException:
+            self.close()
+            raise
+        metrics.observe('connect_seconds', loop.time() - started)
+
+        logger.info('Connection established with {}'.format(self.host))
+
+    async def send(self, request):
+        self.requests += 1
+        self.sent.extend([loop.time()] * request.count(b'\r\n\r\n')) # one per pipelined request
+        await asyncio.wait_for(loop.sock_sendall(self.sock, request), self.timeout)
+
+    async def read(self, nbytes=4096):
+
+        chunk = await asyncio.wait_for(loop.sock_recv(self.sock, nbytes), self.timeout)
+        return chunk
+
+    async def fill(self):
+        chunk = await self.read()
+        if not chunk:
+            self.reusable = False
+            raise ConnectionResetError('Connection closed by {}'.format(self.host))
+        self.buffer.extend(chunk)
+
+    async def read_until(self, delimiter):
+        while delimiter not in self.buffer:
+            await self.fill()
+        at = self.buffer.index(delimiter) + len(delimiter)
+        line = bytes(self.buffer[:at])
+        del self.buffer[:at]
+        return line
+
+    async def read_exactly(self, nbytes):
+        while len(self.buffer) < nbytes:
+            await self.fill()
+        data = bytes(self.buffer[:nbytes])
+        del self.buffer[:nbytes]
+        return data
+
+    async def stream(self, nbytes):
+        """
+        Yield the next `nbytes` bytes, piece by piece as they arrive.
+        """
+        while nbytes:
+            if not self.buffer: await self.fill()
+            piece = bytes(self.buffer[:nbytes])
+            del self.buffer[:len(piece)]
+            nbytes -= len(piece)
+            yield piece
+
+    async def stream_until_close(self):
+        if self.buffer: yield bytes(self.buffer)
+        self.buffer.clear()
+        async for chunk in reader(self.read): yield chunk
+        self.reusable = False
+
+    async def stream_chunked(self):
+        while True:
+            size = int((await self.read_until(b'\r\n')).split(b';')[0], 16)
+            if not size: break
+            async for piece in self.stream(size): yield piece
+            await self.read_exactly(2) # CRLF closing each chunk
+        while (await self.read_until(b'\r\n')) != b'\r\n': pass # trailers
+
+    async def read_response(self):
+
+        sent = self.sent.popleft() if self.sent else loop.time()
+
+        head = (await self.read_until(b'\r\n\r\n')).decode('latin1').split('\r\n')
+        metrics.observe('first_byte_seconds', loop.time() - sent)
+        version, status, *_ = head[0].split(' ', 2)
+        headers = {k.strip().lower(): v.strip()
+                   for line in head[1:] if ':' in line
+                   for k, v in [line.split(':', 1)]}
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            pieces = self.stream_chunked()
+        elif 'content-length' in headers:
+            pieces = self.stream(int(headers['content-length']))
+        else: # delimited by connection close
+            pieces = self.stream_until_close()
+
+        gzipped = headers.get('content-encoding', '').lower() in ('gzip', 'x-gzip')
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+
+        body = bytearray()
+        try:
+            async for piece in pieces:
+                metrics.count('received_bytes', len(piece))
+                body.extend(decompressor.decompress(piece) if decompressor else piece)
+            if decompressor: body.extend(decompressor.flush())
+        except zlib.error as e:
+            self.reusable = False
+            raise ValueError('Corrupted body from {}: {}'.format(self.host, e))
+
+        metrics.observe('response_seconds', loop.time() - sent)
+
+        r = response(version, int(status), headers, body)
+        self.reusable = self.reusable and r.keep_alive
+        return r
+
+    async def request(self, request):
+        await self.send(request)
+        return await self.read_response()
+
+    def close(self):
+        self.reusable = False
+        if self.sock: self.sock.close()
+
+class connection_pool:
+    """
+    Idle persistent connections, kept per host and shared by all fetchers; only
+    connections whose responses ended cleanly should be released to it.
+    """
+
+    def __init__(self, max_idle_per_host=10, timeout=30.0):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self.idle = defaultdict(deque)
+
+    async def acquire(self, host, port):
+        idle = self.idle[(host, port)]
+        while idle:
+            conn = idle.pop()
+            if conn.reusable: return conn
+            conn.close()
+
+        conn = connection(host, port, timeout=self.timeout)
+        await conn.open()
+        return conn
+
+    def release(self, conn):
+        idle = self.idle[(conn.host, conn.port)]
+        if conn.reusable and len(idle) < self.max_idle_per_host:
+            idle.append(conn)
+        else:
+            conn.close()
+
+    def close(self):
+        for idle in self.idle.values():
+            for conn in idle: conn.close()
+            idle.clear()
+
+default_pool = connection_pool()
+
+class rate_limiter:
+    """
+    A non-blocking token bucket, shared by fetchers, allowing `rate` requests per
+    second on average and bursts of `burst` requests at most.
+
+    Throttling answers from the server halve the current rate (down to `min_rate`),
+    once per `cooldown` seconds since a burst of requests in flight is answered by
+    a burst of them; each successful request raises it back by `recovery` towards `rate`.
+    """
+
+    def __init__(self, rate=10.0, burst=10, min_rate=0.1, recovery=1.05, cooldown=5.0):
+        self.max_rate = self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.recovery = recovery
+        self.cooldown = cooldown
+        self.tokens = burst
+        self.updated = loop.time()
+        self.penalized = float('-inf')
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = loop.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self.lock: # waiters are served in order
+            self.refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= 1
+
+    def give_back(self):
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def penalize(self, retry_after=None):
+        now = loop.time()
+        if now - self.penalized >= self.cooldown:
+            self.penalized = now
+            self.rate = max(self.min_rate, self.rate / 2)
+            logger.info('throttled by the server, slowing down to {:.2f} requests per second'.format(self.rate))
+        self.tokens = min(self.tokens, -retry_after * self.rate if retry_after else 0)
+
+    def reward(self):
+        self.rate = min(self.max_rate, self.rate * self.recovery)
+
+THROTTLING_STATUSES = {429, 503}
+
+def retry_after(response):
+    """
+    Return the seconds to wait asked by the `Retry-After` header of `response`, if any.
+    """
+    seconds = response.headers.get('retry-after', '')
+    return int(seconds) if seconds.isdigit() else None
+
 class fetcher:
 
     def __init__(   self, url,
                     resource_key=lambda resource: resource,
-                    done=lambda url, content: print(content)):
+                    done=lambda url, content: print(content),
+                    throttled=lambda url, response: None,
+                    pool=None,
+                    limiter=None):
 
         self.url = url
-        self.response = b''
-        self.sock = None
+        self.response = None
+        self.delivered = None
+        self.handled = False
         self.done = done
+        self.throttled = throttled
+        self.pool = pool or default_pool
+        self.limiter = limiter
         self.resource_key=lambda: resource_key(self.url.resource)
 
     def encode_request(self, encoding='utf8'):
 
-        request = 'GET {} HTTP/1.0\r\nHost: {}\r\n\r\n'.format(
+        request = 'GET {} HTTP/1.1\r\nHost: {}\r\nConnection: keep-alive\r\nAccept-Encoding: gzip\r\n\r\n'.format(
                 self.resource_key(), self.url.host)
 
         return request.encode(encoding)
 
     async def fetch(self):
 
-        self.sock = socket.socket()
-        self.sock.setblocking(False)
+        while True:
 
-        await loop.sock_connect(self.sock, address=(self.url.host, self.url.port))            
+            if self.limiter: await self.limiter.acquire()
 
-        logger.info('Connection established with {} asking resource {}'.format(
-                self.url.host, self.url.resource))
+            conn = await self.pool.acquire(self.url.host, self.url.port)
+            reused = conn.requests > 0
 
-        await loop.sock_sendall(self.sock, self.encode_request())
+            logger.info('Asking resource {} to {}'.format(self.url.resource, self.url.host))
 
-        self.response = await self.read_all()
+            try:
+                self.response = await conn.request(self.encode_request())
+            except BaseException as e:
+                conn.close() # never released, its state is unknown
+                if reused and isinstance(e, (ConnectionError, asyncio.TimeoutError)):
+                    continue # the server dropped or forgot an idle connection, try a fresh one
+                raise
 
-        self.sock.close()
+            self.pool.release(conn)
+            break
 
-        time.sleep(0.1)
+        return self.deliver()
 
-        return self.done(self.url, self.response.decode('utf8'))
+    def deliver(self):
 
-    async def read(self, nbytes=4096):
+        metrics.count('responses', status=self.response.status)
 
-        chunk = await loop.sock_recv(self.sock, nbytes)
-        return chunk
+        if self.response.status in THROTTLING_STATUSES:
+            if self.limiter: self.limiter.penalize(retry_after(self.response))
+            self.delivered = self.throttled(self.url, self.response)
+            self.handled = True
+            return self.delivered
 
-    async def read_all(self):
+        if self.limiter: self.limiter.reward()
 
-        response = [chunk async for chunk in reader(self.read)]
-        return b''.join(response)
+        self.delivered = self.done(self.url, self.response.body)
+        self.handled = True
+        return self.delivered
 
+async def fetch_pipelined(fetchers):
+    """
+    Fetch resources of `fetchers`, all on the same host, pipelining their requests
+    on a single connection; those left unanswered by a dropped connection are
+    fetched one by one.
+    """
+    url, pool = fetchers[0].url, fetchers[0].pool
+    conn = await pool.acquire(url.host, url.port)
+
+    for f in fetchers:
+        if f.limiter: await f.limiter.acquire()
+
+    pending = deque(fetchers)
+    try:
+        await conn.send(b''.join(f.encode_request() for f in fetchers))
+        while pending and conn.reusable:
+            pending[0].response = await conn.read_response()
+            pending.popleft().deliver()
+    except (ConnectionError, ValueError, asyncio.TimeoutError):
+        conn.close()
+    except BaseException:
+        conn.close()
+        raise
+
+    pool.release(conn) # closed, unless every response ended cleanly
+
+    for f in pending:
+        if f.limiter: f.limiter.give_back() # not sent, acquired again by `fetch`
+        await f.fetch()
+
+# scoring policies for the frontier: smaller scores are fetched first,
+# ties are broken by order of arrival.
+FRONTIER_POLICIES = {
+    'fifo':     lambda info: 0,
+    'depth':    lambda info: info['depth'],
+    'indegree': lambda info: (-info['indegree'], info['depth']),
+    'keyword':  lambda info: (-info['boost'], info['depth']),
+}
+
+# the same orders, as SQL over rows of a `storing.frontier_store`
+FRONTIER_ORDERS = {
+    'fifo':     'updated',
+    'depth':    'depth',
+    'indegree': 'indegree desc, depth',
+    'keyword':  'boost desc, depth',
+}
+
+BOOSTING_KEYWORDS = {'nice', 'core'}
+
+def boosting(keywords):
+    return int(bool(BOOSTING_KEYWORDS.intersection(keywords.split(','))))
+
+class priority_frontier:
+    """
+    A deduplicating priority queue of resources to fetch, ordered by `policy`.
+
+    A resource already queued, being fetched or fetched is never queued again;
+    a new reference to a queued one updates its score instead (stale heap
+    entries are skipped when popped). Resources farther than `max_depth` from
+    the seeds are ignored and at most `budget` resources are handed out.
+
+    Resources to retry can be `defer`red: the frontier isn't done until they
+    are queued again, after their delay.
+    """
+
+    def __init__(self, policy='fifo', max_depth=None, budget=None, seen=()):
+        self.policy = policy
+        self.score = FRONTIER_POLICIES[policy]
+        self.max_depth = max_depth
+        self.budget = budget
+        self.seen = set(seen)
+        self.queued = {}
+        self.depths = {}
+        self.heap = []
+        self.arrivals = count()
+        self.served = 0
+        self.in_flight = 0
+        self.deferred = 0
+        self.wakeup = asyncio.Event()
+        self.finished = asyncio.Event()
+
+    def __len__(self):
+        return len(self.queued)
+
+    def exhausted(self):
+        return self.budget is not None and self.served >= self.budget
+
+    def ready(self):
+        return bool(self.queued) and not self.exhausted()
+
+    def push(self, resource, info):
+        heapq.heappush(self.heap, (self.score(info), next(self.arrivals), resource))
+        self.wakeup.set()
+        self.finished.clear()
+
+    def put(self, resource, referrer=None, keywords='', depth=None):
+        """
+        Queue `resource`, referenced by `referrer` whose keywords are `keywords`;
+        return `True` if it is queued (or re-scored) by this call.
+        """
+        return self.queue(resource, referrer, keywords, depth)
+
+    def depth_of(self, referrer=None, depth=None):
+        if depth is not None: return depth
+        return self.depths.get(referrer, 0) + 1 if referrer else 0
+
+    def too_deep(self, depth):
+        return self.max_depth is not None and depth > self.max_depth
+
+    def queue(self, resource, referrer=None, keywords='', depth=None, indegree=0, boost=0):
+        """
+        Like `put`, where `indegree` and `boost` are added to the scores of `resource`.
+        """
+        if resource in self.seen: return False
+
+        depth = self.depth_of(referrer, depth)
+        if self.too_deep(depth): return False
+
+        info = self.queued.setdefault(resource, {'depth': depth, 'indegree': 0, 'boost': 0})
+        info['depth'] = min(info['depth'], depth)
+        info['indegree'] += indegree + bool(referrer)
+        info['boost'] += boost + boosting(keywords)
+
+        self.push(resource, info)
+        return True
+
+    def retry(self, resource):
+        """
+        Queue again `resource`, which has been handed out already but couldn't be fetched.
+        """
+        self.seen.discard(resource)
+        self.served -= 1 # retries don't consume the budget
+        return self.queue(resource, depth=self.depths.get(resource, 0))
+
+    def defer(self, resource, delay):
+        """
+        Queue again `resource` after `delay` seconds.
+        """
+        self.deferred += 1
+        self.finished.clear()
+        loop.call_later(delay, self.undefer, resource)
+
+    def undefer(self, resource):
+        self.deferred -= 1
+        self.retry(resource)
+        if self.idle(): self.finished.set()
+
+    def get_nowait(self):
+        while self.heap and not self.exhausted():
+            score, _, resource = heapq.heappop(self.heap)
+            info = self.queued.get(resource)
+            if info is None or score != self.score(info): continue # stale entry
+            del self.queued[resource]
+            self.seen.add(resource)
+            self.depths[resource] = info['depth']
+            self.served += 1
+            self.in_flight += 1
+            return resource
+        raise asyncio.QueueEmpty
+
+    async def get(self):
+        while True:
+            with suppress(asyncio.QueueEmpty):
+                return self.get_nowait()
+            self.wakeup.clear()
+            await self.wakeup.wait()
+
+    def idle(self):
+        return not self.in_flight and not self.deferred and not self.ready()
+
+    def task_done(self):
+        self.in_flight -= 1
+        if self.idle(): self.finished.set()
+
+    async def join(self):
+        if self.idle(): return
+        await self.finished.wait()
+
+class shared_frontier(priority_frontier):
+    """
+    The `priority_frontier` of shard `shard` of a crawl split among crawlers
+    sharing `store`, a `frontier_store`.
+
+    Resources of other shards are forwarded to the store only; those of this
+    shard are claimed from it before being queued, either at once if they are
+    new or every `poll` seconds if forwarded by another crawler. The crawl is
+    done when no resource is queued or claimed by any crawler.
+
+    Depths and scores of resources travel along with them in the store, so that
+    `max_depth` and `policy` hold across shards as for a single crawler.
+    """
+
+    def __init__(self, store, shard, poll=1.0, claims=100, **kwds):
+        super().__init__(**kwds)
+        self.store = store
+        self.shard = shard
+        self.poll = poll
+        self.claims = claims
+
+    def mine(self, resource):
+        return shard_of(resource, self.store.shards) == self.shard
+
+    def put(self, resource, referrer=None, keywords='', depth=None):
+        if resource in self.queued: # re-scored only
+            return self.queue(resource, referrer, keywords, depth)
+
+        depth = self.depth_of(referrer, depth)
+        if self.too_deep(depth): return False
+
+        added = self.store.add(resource, depth, int(bool(referrer)), boosting(keywords))
+        if added and self.mine(resource):
+            for row in self.store.claim(self.shard, resource, max_depth=self.max_depth):
+                self.claimed(*row)
+        return added
+
+    def claimed(self, resource, depth, indegree, boost):
+        if not self.queue(resource, depth=depth, indegree=indegree, boost=boost) and resource not in self.seen:
+            self.store.release([resource]) # left claimed, `settle` would take it as fetched
+
+    def pull(self):
+        if len(self.queued) >= self.claims or self.exhausted(): return
+        for row in self.store.claim(self.shard, k=self.claims - len(self.queued),
+                                    max_depth=self.max_depth, order=FRONTIER_ORDERS[self.policy]):
+            self.claimed(*row)
+
+    async def join(self):
+        while True:
+            self.pull()
+            if self.idle():
+                # nothing in flight: claimed resources are either fetched, queued (if
+                # out of budget) or dead, the latter being marked by `gave_up` already
+                self.store.release(list(self.queued))
+                self.store.settle(self.shard)
+                if self.exhausted() or not self.store.pending(self.max_depth): return
+                await asyncio.sleep(self.poll)
+            else:
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self.finished.wait(), self.poll)
+
+class retry_scheduler:
+    """
+    Queue again into `frontier` resources that couldn't be fetched, after a
+    jittered exponential backoff: the `n`-th attempt waits a random delay up to
+    `base * 2**(n-1)` seconds, capped at `cap`.
+
+    A resource failing more than `max_attempts` times is given up, calling
+    `gave_up(resource, reason)`, and collected in attribute `dead`.
+    """
+
+    def __init__(self, frontier, base=1.0, cap=300.0, max_attempts=5,
+                 gave_up=lambda resource, reason: None):
+        self.frontier = frontier
+        self.base = base
+        self.cap = cap
+        self.max_attempts = max_attempts
+        self.gave_up = gave_up
+        self.attempts = Counter()
+        self.dead = {}
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.cap, self.base * 2 ** (attempt - 1)))
+
+    def __call__(self, resource, reason=None):
+        """
+        Schedule a new attempt of `resource`, which failed because of `reason`;
+        return `False` if it has been given up.
+        """
+        self.attempts[resource] += 1
+        attempt = self.attempts[resource]
+        metrics.count('errors', kind=type(reason).__name__ if isinstance(reason, BaseException) else reason)
+
+        if attempt > self.max_attempts:
+            logger.warning('giving up resource {} after {} attempts: {}'.format(
+                resource, attempt - 1, reason))
+            self.give_up(resource, reason)
+            return False
+
+        delay = self.delay(attempt)
+        logger.info('retrying resource {} in {:.2f} seconds (attempt {}): {}'.format(
+            resource, delay, attempt, reason))
+        self.frontier.defer(resource, delay)
+        metrics.count('retries')
+        return True
+
+    def give_up(self, resource, reason):
+        """
+        Record `resource` as a dead letter, because of `reason`.
+        """
+        self.dead[resource] = reason
+        metrics.count('given_up')
+        self.gave_up(resource, reason)
+
+    def throttled(self, resource, delay=None):
+        """
+        Queue again `resource`, refused by a throttling server, after `delay` seconds
+        or a first backoff; it is not the resource's fault, so no attempt is spent.
+        """
+        delay = self.delay(1) if delay is None else delay
+        logger.info('fetching resource {} again in {:.2f} seconds, throttled'.format(resource, delay))
+        self.frontier.defer(resource, delay)
+        metrics.count('throttled')
 
 class crawler:
+    """
+    Fetch resources with `max_tasks` workers, each pipelining `pipeline` requests at most.
+
+    Callbacks of fetchers may return a future, for work done off the event loop:
+    workers go on fetching meanwhile, as long as less than `max_pending` of them
+    are outstanding; a resource is done when its future is.
+    """
 
-    def __init__(self, resources, fetcher_factory, max_tasks):
+    def __init__(self, resources, fetcher_factory, max_tasks, pipeline=1, frontier=None, retry=None,
+                 max_pending=100):
 
         self.resources = resources
         self.max_tasks = max_tasks
         self.fetcher_factory = fetcher_factory
-        self.q = asyncio.Queue()
+        self.pipeline = pipeline
+        self.frontier = priority_frontier() if frontier is None else frontier
+        self.retry = retry_scheduler(self.frontier) if retry is None else retry
+        self.pending = asyncio.Semaphore(max_pending)
+        self.outstanding = 0
 
     async def crawl(self):
 
-        for res in self.resources: self.q.put_nowait(res)
+        metrics.gauge('frontier_size', lambda: len(self.frontier))
+        metrics.gauge('in_flight', lambda: self.frontier.in_flight - self.outstanding)
+        metrics.gauge('deferred', lambda: self.frontier.deferred)
+        metrics.gauge('outstanding', lambda: self.outstanding)
+
+        for res in self.resources: self.frontier.put(res)
 
         tasks = [loop.create_task(coro=self.work()) for _ in range(self.max_tasks)]
 
-        await self.q.join()
+        await self.frontier.join()
         
         for t in tasks: t.cancel()
 
@@ -112,11 +697,44 @@ class crawler:
 
         while True:
 
-            resource = await self.q.get()
-
-            await self.fetcher_factory(resource, appender=self.q.put_nowait).fetch()
-            
-            self.q.task_done()
+            batch = [await self.frontier.get()]
+            while len(batch) < self.pipeline and self.frontier.ready():
+                with suppress(asyncio.QueueEmpty):
+                    batch.append(self.frontier.get_nowait())
+
+            owed = len(batch) # resources done, unless a future settles them later
+            try:
+                fetchers = []
+                for resource in batch:
+                    try:
+                        fetchers.append(self.fetcher_factory(resource, appender=self.frontier.put, retry=self.retry))
+                    except Exception as e: # fetching it again would fail the same way
+                        logger.warning('giving up resource {}, no fetcher for it: {!r}'.format(resource, e))
+                        metrics.count('errors', kind=type(e).__name__)
+                        self.retry.give_up(resource, e)
+                if not fetchers: continue
+
+                try:
+                    if len(fetchers) > 1:   await fetch_pipelined(fetchers)
+                    else:                   await fetchers[0].fetch()
+                except Exception as e:
+                    logger.info('fetching {} failed: {!r}'.format([f.url.resource for f in fetchers], e))
+                    for f in fetchers:
+                        if not f.handled: self.retry(f.url.resource, e) # never answered, or its callback failed
+
+                for f in fetchers:
+                    if asyncio.isfuture(f.delivered):
+                        await self.pending.acquire() # backpressure, when too much work is outstanding
+                        self.outstanding += 1
+                        f.delivered.add_done_callback(self.settle)
+                        owed -= 1
+            finally:
+                for _ in range(owed): self.frontier.task_done()
+
+    def settle(self, future):
+        self.outstanding -= 1
+        self.pending.release()
+        self.frontier.task_done()
 
 
 #________________________________________________________________________________}}}
@@ -138,53 +756,153 @@ def sets_of_cross_references(doc, sections=['xref']):
     return sets
 
 def parse_json( url, content, appender, seen_urls, 
-                stubborn=False, progress_mark=None, cache_dir='./fetched/'):
+                retry=None, progress_mark=None, cache_dir='./fetched/', journal=None):
     
     references = set()
+    keywords = ''
 
     try:
-        doc = json.loads(content[content.index('\n{'):])
+        with metrics.timer('parse_seconds'):
+            doc = json.loads(content)
         
-        with open('{}{}.json'.format(cache_dir, url.resource), 'w') as f:
-            json.dump(doc, f)
-            f.flush()
+        with metrics.timer('write_seconds'):
+            json_dump(doc, url.resource, cache_dir)
+        metrics.count('fetched')
 
         if progress_mark:
             print(progress_mark, end='', flush=True)
         
         seen_urls.add(url.resource)
+        if journal: journal.fetched(url.resource)
         logger.info('fetched resource {}'.format(url.resource))
 
         references.update(*sets_of_cross_references(doc))
+        keywords = ','.join(result.get('keyword', '') for result in doc.get('results', None) or [])
         
     except ValueError as e:
         message = 'Generic error for resource {}:\n{}\nRaw content: {}'
         logger.info(message.format(url.resource, e, content))
-        if stubborn: references.add(url.resource)
+        if retry: retry(url.resource, e)
 
     except json.JSONDecodeError as e:
         message = 'Decoding error for {}:\nException: {}\nRaw content: {}'
         logger.info(message.format(url.resource, e, content))
-        if stubborn: references.add(url.resource)
+        if retry: retry(url.resource, e)
 
     for ref in references - seen_urls:
-        appender(ref)
+        appender(ref, referrer=url.resource, keywords=keywords)
+
+def digest_document(content):
+    """
+    Decode `content`, returning its cross references, its keywords and its index `digest`;
+    run by processes of a `digester`.
+    """
+    doc = json.loads(content)
+    references = set().union(*sets_of_cross_references(doc))
+    keywords = ','.join(result.get('keyword', '') for result in doc.get('results', None) or [])
+    return references, keywords, digest(doc)
+
+def store_digested(cache_dir, resource, content, digested):
+    stamp = open_storage(cache_dir).put_raw(resource, bytes(content))
+    open_index(cache_dir).record_digested([(resource, digested, stamp)])
+
+def check_digested(cache_dir, resource):
+    open_index(cache_dir).checked([resource])
+
+REVISION_AT = PROJECTED_FIELDS.index('revision')
+
+def revision_of(digested):
+    projected, *_ = digested
+    return projected[REVISION_AT]
+
+class digester:
+    """
+    Work of `parse_json` done off the event loop: documents are decoded by a pool
+    of `processes` (all cores by default, none to decode them on the loop), then
+    stored and indexed by a single writer thread, since the storage and the index
+    have one writer at a time.
+    """
+
+    def __init__(self, cache_dir, processes=None):
+        self.cache_dir = cache_dir
+        self.parsers = ProcessPoolExecutor(processes) if processes != 0 else None
+        self.writer = ThreadPoolExecutor(max_workers=1)
+
+    async def digest(self, content):
+        if self.parsers is None: return digest_document(content)
+        return await loop.run_in_executor(self.parsers, digest_document, content)
+
+    async def store(self, resource, content, digested):
+        await loop.run_in_executor(self.writer, store_digested, self.cache_dir, resource, content, digested)
+
+    async def check(self, resource):
+        await loop.run_in_executor(self.writer, check_digested, self.cache_dir, resource)
+
+    def close(self):
+        if self.parsers: self.parsers.shutdown()
+        self.writer.shutdown()
+
+async def digest_json(url, content, appender, seen_urls, digester,
+                      retry=None, progress_mark=None, journal=None, known=None):
+    """
+    Like `parse_json`, using `digester` to keep the event loop free.
+
+    Mapping `known` associates sequences already cached to the `(revision,
+    references)` pair they have there: such a sequence is rewritten only if its
+    revision changed, and only its new references are followed.
+    """
+    previous = known.get(url.resource) if known else None
 
-def lookup_fetched_filenames(subdir): 
-    return {filename[:filename.index('.json')]: subdir + filename 
-            for filename in os.listdir(subdir) if filename.endswith('.json')}
+    try:
+        with metrics.timer('parse_seconds'):
+            references, keywords, digested = await digester.digest(content)
+
+        if previous and previous[0] is not None and previous[0] == revision_of(digested):
+            await digester.check(url.resource)
+            references = set()
+            metrics.count('unchanged')
+        else:
+            with metrics.timer('write_seconds'):
+                await digester.store(url.resource, content, digested)
+            if previous:
+                references -= previous[1]
+                metrics.count('changed')
+        metrics.count('fetched')
+    except ValueError as e:
+        message = 'Decoding error for {}:\nException: {}\nRaw content: {}'
+        logger.info(message.format(url.resource, e, content))
+        if retry: retry(url.resource, e)
+        return
+    except Exception as e: # a broken parser process, a failed write: fetch it again
+        logger.warning('Digesting error for {}: {!r}'.format(url.resource, e))
+        if retry: retry(url.resource, e)
+        return
+
+    if progress_mark:
+        print(progress_mark, end='', flush=True)
+
+    seen_urls.add(url.resource)
+    if journal: journal.fetched(url.resource)
+    logger.info('fetched resource {}'.format(url.resource))
+
+    for ref in references - seen_urls:
+        appender(ref, referrer=url.resource, keywords=keywords)
 
 def urls_in_cache(subdir):
 
-    fetched_resources = lookup_fetched_filenames(subdir)
+    storage = open_storage(subdir)
 
     seen_urls = set()
     initial_urls = set()
 
-    for resource, filename in fetched_resources.items():
+    for resource in storage.ids():
 
-        with open(filename) as f:
-            doc = json.loads(f.read())  
+        doc = storage.get(resource)
+
+        # partial documents, from bulk imports, are still to be fetched in full
+        if doc.get('partial', False):
+            initial_urls.add(resource)
+            continue
 
         # every resource with a attached file should be considered as an already seen urls
         seen_urls.add(resource) 
@@ -192,9 +910,54 @@ def urls_in_cache(subdir):
         # we consider its fringe as starting set of resources to fetch
         initial_urls.update(*sets_of_cross_references(doc))
 
-    return RestartingUrls(seen=seen_urls, fringe=initial_urls-seen_urls)
-
-def oeis(loop, initial_urls, workers, progress_mark, cache_dir):
+    return RestartingUrls(seen=seen_urls, fringe=initial_urls-seen_urls, dead=set())
+
+def restarting_urls(cache_dir):
+    """
+    Return the `RestartingUrls` of the crawl in `cache_dir`, replaying its journal;
+    a cache without one is scanned once, writing the journal for next restarts.
+    """
+    journal = frontier_journal(cache_dir)
+
+    if journal.exists():
+        seen, fringe = journal.load()
+    else:
+        seen, fringe, _ = urls_in_cache(subdir=cache_dir)
+        journal.reset(seen, fringe)
+
+    return RestartingUrls(seen=set(seen), fringe=set(fringe), dead=set(journal.dead))
+
+def sharded_urls(cache_dir, cached_urls, shard, sequences):
+    """
+    Return the `RestartingUrls` of the crawler of `shard`, a `(K, N)` pair, seeding
+    the shared frontier with `cached_urls` and recovering ids the crawler claimed
+    without finishing them, if it was stopped; `sequences` are the new seeds.
+    """
+    store = frontier_store(cache_dir, shards=shard[1])
+    store.seed(fetched=cached_urls.seen, queued=cached_urls.fringe)
+    store.recover(shard[0], fetched=cached_urls.seen)
+    store.close()
+    return RestartingUrls(seen=cached_urls.seen, fringe=set(sequences), dead=cached_urls.dead)
+
+def refreshing_urls(cache_dir, cached_urls, older_than=None, revised_before=None, k=None):
+    """
+    Return the `RestartingUrls` to fetch again the stale sequences in `cache_dir`,
+    oldest first (see `cache_index.stale`), and the mapping from each of them to
+    the `(revision, references)` pair that is cached, for `digest_json`.
+    """
+    index = open_index(cache_dir)
+    stale = index.stale(older_than=older_than, revised_before=revised_before, k=k)
+    selected = set(stale)
+
+    known = {seq_id: (p['revision'], cross_references(p['xref'] or []))
+             for seq_id, p in index.project(['revision', 'xref']) if seq_id in selected}
+
+    urls = RestartingUrls(seen=cached_urls.seen - selected, fringe=stale, dead=cached_urls.dead)
+    return urls, known
+
+def oeis(loop, initial_urls, workers, progress_mark, cache_dir, pipeline=1, rate=10.0, burst=10, timeout=30.0,
+         policy='fifo', max_depth=None, budget=None, max_attempts=5, parsers=None, max_pending=100,
+         metrics_file=None, metrics_interval=10.0, metrics_port=None, known=None, shard=None):
 
     seen_urls = set()
 
@@ -203,21 +966,82 @@ def oeis(loop, initial_urls, workers, progress_mark, cache_dir):
     logger.info('restarting with {} urls in the fringe, having fetched already {} resources.'.format(
             len(initial_urls.fringe), len(initial_urls.seen)))
 
-    def factory(resource, appender):
+    limiter = rate_limiter(rate=rate, burst=burst)
+    connections = connection_pool(timeout=timeout)
+    metrics.gauge('rate', lambda: limiter.rate)
+
+    # sharing the journal, crawlers of a sharded crawl append to it but never rewrite it
+    journal = frontier_journal(cache_dir, compact_every=None if shard else 100000)
+    journal.load()
+    for resource in initial_urls.fringe: journal.enqueued(resource)
+
+    frontier_kwds = {'policy': policy, 'max_depth': max_depth, 'budget': budget,
+                     # dead letters are skipped, unless asked for explicitly
+                     'seen': seen_urls | initial_urls.dead.difference(initial_urls.fringe)}
+
+    if shard:
+        store = frontier_store(cache_dir, shards=shard[1])
+        frontier = shared_frontier(store, shard[0], **frontier_kwds)
+    else:
+        store = None
+        frontier = priority_frontier(**frontier_kwds)
+
+    def gave_up(resource, reason):
+        journal.gave_up(resource)
+        if store: store.gave_up(resource)
+
+    retry = retry_scheduler(frontier, max_attempts=max_attempts, gave_up=gave_up)
+
+    # documents are parsed on the event loop when no parser process is asked for,
+    # unless there are `known` ones to compare with
+    pool = digester(cache_dir, processes=parsers) if parsers != 0 or known else None
+
+    def factory(resource, appender, retry):
+
+        def journaled_appender(ref, **kwds):
+            if appender(ref, **kwds): journal.enqueued(ref)
+
         url = URL(host='oeis.org', port=80, resource=resource)
-        kwds = {'appender': appender, 
+        kwds = {'appender': journaled_appender, 
                 'seen_urls': seen_urls, 
                 'progress_mark': progress_mark, 
-                'cache_dir': cache_dir}
-        return fetcher( url, done=partial(parse_json, **kwds), resource_key=make_resource)
+                'journal': journal,
+                'retry': retry}
+        if pool:
+            done = lambda url, content: loop.create_task(digest_json(url, content, digester=pool, known=known, **kwds))
+        else:
+            done = partial(parse_json, cache_dir=cache_dir, **kwds)
+        return fetcher( url, done=done, resource_key=make_resource,
+                        throttled=lambda url, response: retry.throttled(url.resource, retry_after(response)),
+                        limiter=limiter,
+                        pool=connections)
 
     crawl_job = crawler(resources=initial_urls.fringe, 
                         fetcher_factory=factory, 
-                        max_tasks=workers)
+                        max_tasks=workers,
+                        pipeline=pipeline,
+                        frontier=frontier,
+                        retry=retry,
+                        max_pending=max_pending)
+
+    snapshots = loop.create_task(write_snapshots(metrics, metrics_file, metrics_interval)) if metrics_file else None
+    server = loop.run_until_complete(serve(metrics, metrics_port)) if metrics_port else None
 
     with suppress(KeyboardInterrupt):
         loop.run_until_complete(crawl_job.crawl())
 
+    if snapshots:
+        snapshots.cancel()
+        write_snapshot(metrics, metrics_file)
+    if server: server.close()
+
+    if pool: pool.close()
+    connections.close()
+
+    if store: store.close()
+    else: journal.compact()
+    journal.close()
+
     fetched_urls = seen_urls - initial_urls.seen
 
     return fetched_urls
@@ -226,6 +1050,13 @@ def oeis(loop, initial_urls, workers, progress_mark, cache_dir):
 
 # argument parsing {{{
 
+def shard_spec(spec):
+    import argparse
+    k, _, n = spec.partition('/')
+    if not (k.isdigit() and n.isdigit() and int(k) < int(n)):
+        raise argparse.ArgumentTypeError('{} is not a shard K/N, with 0 <= K < N'.format(spec))
+    return int(k), int(n)
+
 def handle_cli_arguments():
 
     import argparse
@@ -238,8 +1069,44 @@ def handle_cli_arguments():
                         action="store_true")
     parser.add_argument("--restart", help="Build fringe from cached sequences (defaults to False)", 
                         action="store_true", default=False)
+    parser.add_argument("--refresh", help="Fetch again stale sequences, according to --older-than and --revised-before, rewriting changed ones only (defaults to False)",
+                        action="store_true", default=False)
+    parser.add_argument("--older-than", help="Sequences fetched or checked more than D days ago are stale (defaults to 30)",
+                        metavar='D', type=float, default=30.0)
+    parser.add_argument("--revised-before", help="Sequences whose OEIS time is before DATE, as 2017-06-01, are stale (defaults to None)",
+                        metavar='DATE', default=None)
+    parser.add_argument("--shard", help="Fetch only sequences of shard K out of N, sharing the frontier with crawlers of other shards on the same cache (defaults to None)",
+                        metavar='K/N', type=shard_spec, default=None)
+    parser.add_argument("--retry-dead", help="Fetch again sequences given up by previous crawls (defaults to False)", 
+                        action="store_true", default=False)
+    parser.add_argument("--max-attempts", help="Give up a sequence after N failed attempts (defaults to 5)",
+                        metavar='N', type=int, default=5)
     parser.add_argument("--workers", help="Degree of parallelism (defaults to 10)", 
                         type=int, default=10)
+    parser.add_argument("--rate", help="Requests per second sent to the server, on average (defaults to 10)", 
+                        type=float, default=10.0)
+    parser.add_argument("--burst", help="Requests sent to the server at once, at most (defaults to 10)", 
+                        type=int, default=10)
+    parser.add_argument("--timeout", help="Seconds to wait for connecting and for each read or write, at most (defaults to 30)",
+                        metavar='S', type=float, default=30.0)
+    parser.add_argument("--pipeline", help="Requests pipelined on each persistent connection (defaults to 1)", 
+                        type=int, default=1)
+    parser.add_argument("--parsers", help="Processes decoding fetched sequences, 0 to decode them in the crawling one (defaults to one per core)",
+                        metavar='P', type=int, default=None)
+    parser.add_argument("--max-pending", help="Fetched sequences waiting to be decoded and stored, at most (defaults to 100)",
+                        metavar='N', type=int, default=100)
+    parser.add_argument("--policy", help="Order of fetching, by arrival, distance from seeds, references seen so far or `nice`/`core` referrers (defaults to fifo)",
+                        choices=sorted(FRONTIER_POLICIES), default='fifo')
+    parser.add_argument("--max-depth", help="Ignore sequences farther than D references from seeds (defaults to None)",
+                        metavar='D', type=int, default=None)
+    parser.add_argument("--budget", help="Fetch N sequences at most (defaults to None)",
+                        metavar='N', type=int, default=None)
+    parser.add_argument("--metrics-file", help="Append a JSON line of crawl metrics to FILE periodically (defaults to None)",
+                        metavar='FILE', default=None)
+    parser.add_argument("--metrics-interval", help="Seconds between lines of --metrics-file (defaults to 10)",
+                        metavar='S', type=float, default=10.0)
+    parser.add_argument("--metrics-port", help="Serve crawl metrics, Prometheus style, on localhost:PORT (defaults to None)",
+                        metavar='PORT', type=int, default=None)
     parser.add_argument("--log-level", help="Logger verbosity (defaults to ERROR)",
                         choices=['DEBUG','INFO','WARNING','ERROR','CRITICAL'], default='ERROR')
     parser.add_argument("--cache-dir", help="Cache directory (defaults to ./fetched/)",
@@ -258,36 +1125,71 @@ if __name__ == "__main__":
 
     args = handle_cli_arguments()
 
-    cached_urls = urls_in_cache(subdir=args.cache_dir)
+    cached_urls = restarting_urls(cache_dir=args.cache_dir)
 
     if args.clear_cache:
         removed = 0
-        for sequence in cached_urls.seen:
-            filename = '{}{}.json'.format(args.cache_dir, sequence)
-            os.remove(filename) 
+        storage, index = open_storage(args.cache_dir), open_index(args.cache_dir)
+        for sequence in storage.ids():
+            storage.remove(sequence)
+            index.forget(sequence)
             removed += 1
 
         print('{} sequences removed from cache {}'.format(removed, args.cache_dir))
         cached_urls.seen.clear()
         cached_urls.fringe.clear()
+        cached_urls.dead.clear()
+        frontier_journal(args.cache_dir).reset(seen=[], fringe=[])
 
     logger.setLevel(args.log_level)
 
-    if not args.sequences and not args.restart:
-        print('{} sequences in cache {}\n{} sequences in fringe for restarting'.format(
-            len(cached_urls.seen), args.cache_dir, len(cached_urls.fringe)))
+    crawling = {'workers': args.workers,
+                'progress_mark': args.progress_mark,
+                'cache_dir': args.cache_dir,
+                'pipeline': args.pipeline,
+                'rate': args.rate,
+                'burst': args.burst,
+                'timeout': args.timeout,
+                'policy': args.policy,
+                'max_depth': args.max_depth,
+                'budget': args.budget,
+                'max_attempts': args.max_attempts,
+                'parsers': args.parsers,
+                'max_pending': args.max_pending,
+                'metrics_file': args.metrics_file,
+                'metrics_interval': args.metrics_interval,
+                'metrics_port': args.metrics_port}
+
+    if args.refresh:
+        refreshing, known = refreshing_urls(args.cache_dir, cached_urls,
+                                            older_than=args.older_than * 24 * 60 * 60,
+                                            revised_before=args.revised_before,
+                                            k=args.budget)
+        fetched_urls = oeis(loop=loop, initial_urls=refreshing, known=known, **crawling)
+
+        refreshed, discovered = fetched_urls & known.keys(), fetched_urls - known.keys()
+        print('\nchecked {} stale sequences, {} changed; fetched {} new sequences:\n{}'.format(
+            len(refreshed), metrics.value('changed'), len(discovered), discovered))
+    elif args.shard:
+        sharded = sharded_urls(args.cache_dir, cached_urls, args.shard, args.sequences)
+        fetched_urls = oeis(loop=loop, initial_urls=sharded, shard=args.shard, **crawling)
+
+        print('\nfetched {} new sequences in shard {}/{}:\n{}'.format(
+            len(fetched_urls), *args.shard, fetched_urls))
+    elif not args.sequences and not args.restart and not args.retry_dead:
+        print('{} sequences in cache {}\n{} sequences in fringe for restarting\n{} sequences given up'.format(
+            len(cached_urls.seen), args.cache_dir, len(cached_urls.fringe), len(cached_urls.dead)))
     else:     
-        if not args.restart:  
+        if args.retry_dead:
+            cached_urls.fringe.clear()
+            cached_urls.fringe.update(cached_urls.dead)
+        elif not args.restart:  
             cached_urls.fringe.clear()
 
         cached_urls.fringe.update(set(args.sequences))
 
         if not cached_urls.fringe.issubset(cached_urls.seen):
-            fetched_urls = oeis(loop=loop, 
-                                initial_urls=cached_urls, 
-                                workers=args.workers,
-                                progress_mark=args.progress_mark,
-                                cache_dir=args.cache_dir)
+            fetched_urls = oeis(loop=loop, initial_urls=cached_urls, **crawling)
 
             print('\nfetched {} new sequences:\n{}'.format(len(fetched_urls), fetched_urls))
         else:
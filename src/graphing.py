@@ -1,19 +1,183 @@
 
 import networkx as nx
+import numpy as np
 import commons
 import math
 import random
 
-from collections import defaultdict
+from itertools import chain
+
+from indexing import COUNTED_FIELDS
+
+def graph_load(cache_dir='./fetched/', compact=False, documents=False):
+    """
+    Build the graph of sequences in `cache_dir` from its xrefs sidecar alone, decoding
+    no document, so nodes hold `keyword`, `counts` and cross references only; with
+    `documents` true, nodes are whole results of cached documents instead (with
+    `name`, `data` and so on), as built by `adjust_crossreferences`. The graph is
+    a `compact_graph` if `compact` is true.
+    """
+    if documents:
+        graph = adjust_crossreferences(commons.cache_view(cache_dir, add_path_attr=False))
+        return compact_graph.from_graph(graph) if compact else graph
+
+    index = commons.open_index(cache_dir)
+    index.refresh()
+    adjacency = index.xrefs.load()
+    return compact_graph.from_adjacency(adjacency) if compact else adjacency_graph(adjacency)
+
+def adjacency_graph(adjacency):
+    """
+    Like `adjust_crossreferences`, for records of a `storing.xref_sidecar`; nodes
+    keep `keyword` and `counts` of `indexing.COUNTED_FIELDS` only.
+    """
+    graph = {k: {'keyword': keyword,
+                 'counts': dict(zip(COUNTED_FIELDS, counts)),
+                 'xref_complete': set(references)}
+             for k, (keyword, counts, references) in adjacency.items()}
+
+    for k, node in graph.items():
+        node['xref_as_set'] = {xr for xr in node['xref_complete'] if xr in graph}
+        for ref in node['xref_as_set']:
+            graph[ref].setdefault('referees', set()).add(k)
 
-def graph_load(cache_dir='./fetched/'):
-    docs = commons.cache_reify(cache_dir)
-    graph = adjust_crossreferences(docs)
     return graph
 
+class compact_graph:
+    """
+    A directed graph of sequences stored in NumPy arrays, whose nodes are dense
+    integers: node `i` is sequence `ids[i]`, where `ids` is sorted.
+
+    Node `i` references nodes `indices[indptr[i]:indptr[i+1]]` and is referenced
+    by nodes `rindices[rindptr[i]:rindptr[i+1]]`, both adjacencies being in
+    CSR form; per-node attributes are arrays in `columns`, aligned with `ids`.
+    With 32-bit node ids, an edge costs 8 bytes in both directions together.
+    """
+
+    def __init__(self, ids, indptr, indices, columns={}):
+        self.ids = ids
+        self.indptr = indptr
+        self.indices = indices
+        self.columns = dict(columns)
+
+        sources = np.repeat(np.arange(len(ids), dtype=np.int32), np.diff(indptr))
+        order = np.argsort(indices, kind='stable')
+        self.rindices = sources[order]
+        self.rindptr = np.concatenate([[0], np.cumsum(np.bincount(indices, minlength=len(ids)))]).astype(indptr.dtype)
+
+    @classmethod
+    def from_adjacency(cls, adjacency):
+        """
+        Build the closed-world graph of records of a `storing.xref_sidecar`:
+        references to sequences outside `adjacency` are dropped.
+        """
+        ids = np.array(sorted(adjacency), dtype='U7')
+        records = [adjacency[seq_id] for seq_id in ids.tolist()]
+
+        lengths = np.fromiter((len(references) for _, _, references in records), dtype=np.int64, count=len(ids))
+        targets = np.array([r for _, _, references in records for r in references], dtype='U7')
+        sources = np.repeat(np.arange(len(ids), dtype=np.int32), lengths)
+
+        positions = np.searchsorted(ids, targets)
+        inside = positions < len(ids)
+        inside[inside] = ids[positions[inside]] == targets[inside]
+        sources, positions = sources[inside], positions[inside].astype(np.int32)
+
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(sources, minlength=len(ids)))]).astype(np.int64)
+
+        columns = {f: np.fromiter((counts[i] for _, counts, _ in records), dtype=np.int32, count=len(ids))
+                   for i, f in enumerate(COUNTED_FIELDS)}
+        columns['keyword'] = np.array([keyword for keyword, _, _ in records], dtype=object)
+
+        return cls(ids, indptr, positions, columns)
+
+    @classmethod
+    def from_graph(cls, graph):
+        """
+        Build the graph of `graph`, as returned by `adjust_crossreferences` or `adjacency_graph`.
+        """
+        return cls.from_adjacency({
+            k: (v.get('keyword', ''),
+                tuple((v.get('counts') or {}).get(f, len(v.get(f, []))) for f in COUNTED_FIELDS),
+                sorted(v['xref_as_set']))
+            for k, v in graph.items()})
+
+    def __len__(self):
+        return len(self.ids)
+
+    def number_of_edges(self):
+        return len(self.indices)
+
+    def nbytes(self):
+        arrays = [self.ids, self.indptr, self.indices, self.rindptr, self.rindices]
+        return sum(a.nbytes for a in arrays + [c for c in self.columns.values() if c.dtype != object])
+
+    def nodes_of(self, seq_ids):
+        """
+        Return the array of nodes of `seq_ids`, raising `KeyError` for unknown ones.
+        """
+        seq_ids = np.asarray(seq_ids, dtype='U7')
+        positions = np.searchsorted(self.ids, seq_ids)
+        found = positions < len(self.ids)
+        found[found] = self.ids[positions[found]] == seq_ids[found]
+        if not found.all():
+            raise KeyError(seq_ids[~found].tolist())
+        return positions
+
+    def successors(self, seq_id):
+        i = self.nodes_of([seq_id])[0]
+        return self.ids[self.indices[self.indptr[i]:self.indptr[i+1]]]
+
+    def predecessors(self, seq_id):
+        i = self.nodes_of([seq_id])[0]
+        return self.ids[self.rindices[self.rindptr[i]:self.rindptr[i+1]]]
+
+    def out_degrees(self):
+        return np.diff(self.indptr)
+
+    def in_degrees(self):
+        return np.diff(self.rindptr)
+
+    def edges(self):
+        """
+        Return the pair of arrays of source and target nodes of every edge.
+        """
+        return np.repeat(np.arange(len(self.ids), dtype=np.int32), self.out_degrees()), self.indices
+
+    def subgraph(self, seq_ids):
+        """
+        Return the `compact_graph` induced by `seq_ids`.
+        """
+        nodes = np.unique(self.nodes_of(seq_ids))
+        renumber = np.full(len(self.ids), -1, dtype=np.int32)
+        renumber[nodes] = np.arange(len(nodes), dtype=np.int32)
+
+        sources, targets = self.edges()
+        kept = (renumber[sources] >= 0) & (renumber[targets] >= 0)
+        sources, targets = renumber[sources[kept]], renumber[targets[kept]]
+
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(sources, minlength=len(nodes)))]).astype(np.int64)
+        return compact_graph(self.ids[nodes], indptr, targets, {f: c[nodes] for f, c in self.columns.items()})
+
+    def to_networkx(self, seq_ids=None, digraph=False):
+        """
+        Return a networkx graph of the subgraph induced by `seq_ids` (the whole
+        graph, if `None`), whose nodes have attributes of `columns`.
+        """
+        g = self.subgraph(seq_ids) if seq_ids is not None else self
+        G = nx.DiGraph() if digraph else nx.Graph()
+
+        names = g.ids.tolist()
+        G.add_nodes_from((n, {f: c[i].item() if c.dtype != object else c[i] for f, c in g.columns.items()})
+                         for i, n in enumerate(names))
+        sources, targets = g.edges()
+        G.add_edges_from(zip(g.ids[sources].tolist(), g.ids[targets].tolist()))
+        return G
+
 def adjust_crossreferences(docs):
 
-    graph = {k:v['results'].pop() for k, v in docs.items()}
+    # `docs` can be a lazy `commons.cache_view`, so don't mutate its documents.
+    graph = {k:dict(v['results'][-1]) for k, v in docs.items() if v['results']}
 
     for k, result in graph.items():
 
@@ -31,79 +195,318 @@ def adjust_crossreferences(docs):
 
     return graph
 
+def node_colours(graph):
+    """
+    Return the array of `(red, green, blue)` rows of nodes of `compact_graph` `graph`,
+    scaled in [0, 255]: red counts comments and formulae, green references and
+    links, blue incident edges.
+    """
+    c = graph.columns
+    colours = np.column_stack([c['comment'] + c['formula'],
+                               c['reference'] + c['link'],
+                               graph.out_degrees() + graph.in_degrees()]).astype(float)
+    return 255 * colours / np.maximum(colours.max(axis=0, initial=0), 1)
+
+def edge_lines(graph, edge_symbol='--', chunk_size=2**16):
+    """
+    Iterate over chunks of lines `Axxxxxx -- Ayyyyyy`, one per edge of `compact_graph` `graph`.
+    """
+    sources, targets = graph.edges()
+    for start in range(0, len(sources), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        yield ['{} {} {}'.format(u, edge_symbol, v) for u, v in zip(graph.ids[sources[chunk]].tolist(),
+                                                                   graph.ids[targets[chunk]].tolist())]
+
+def label_lines(graph, colours, chunk_size=2**16):
+    """
+    Iterate over chunks of lines `Axxxxxx { color:#RRGGBB }`, one per node of `compact_graph`
+    `graph`, whose colour is the complement of its row in `colours`.
+    """
+    complements = np.floor(255 - colours).astype(int)
+    for start in range(0, len(graph), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        yield ['{} {{ color:#{:02X}{:02X}{:02X} }}'.format(node, r, g, b)
+               for node, (r, g, b) in zip(graph.ids[chunk].tolist(), complements[chunk].tolist())]
+
+def write_graph(graph, f, edge_symbol='--', chunk_size=2**16):
+    """
+    Write edges and coloured labels of `compact_graph` `graph` to file `f`, a chunk
+    of lines at a time, so that memory doesn't grow with the graph size.
+    """
+    f.write("-> { color: #ffffff }\n")
+    chunks = chain(edge_lines(graph, edge_symbol, chunk_size),
+                   label_lines(graph, node_colours(graph), chunk_size))
+    for i, lines in enumerate(chunk for chunk in chunks if chunk):
+        if i: f.write("\n")
+        f.write("\n".join(lines))
+
 def make_nx_graph(graph, digraph=False,
                   node_remp=lambda n, G: False,
                   edge_remp=lambda u, v, G: False):
+    """
+    Return the networkx graph of the edges of `graph`, either a dict as returned by
+    `graph_load` or a `compact_graph`, together with a mapping from each node to
+    its `node_colours` and an iterator over lines of its edges.
+    """
+    compact = graph if isinstance(graph, compact_graph) else compact_graph.from_graph(graph)
 
     G, edge_symbol = (nx.DiGraph(), '->') if digraph else (nx.Graph(), '--')
 
     edge_symbol = '--'
-    edges = []
-    reds, greens, blues = {}, {}, {}
-    for seq_id, v in graph.items():
-
-        for ref_seq_id in v['xref_as_set']:
-            G.add_edge(seq_id, ref_seq_id)
-            edges.append("{} {} {}".format(seq_id, edge_symbol, ref_seq_id))
-
-        comments, formulae, references, links, outgoing, incoming = map(
-            len, [v.get('comment',[]),
-                  v.get('formula', []),
-                  v.get('reference', []),
-                  v.get('link', []),
-                  v.get('xref_as_set', set()),
-                  v.get('referees', set())])
-        reds[seq_id] = comments + formulae
-        greens[seq_id] = references + links
-        blues[seq_id] = outgoing + incoming
+    sources, targets = compact.edges()
+    G.add_edges_from(zip(compact.ids[sources].tolist(), compact.ids[targets].tolist()))
+    edges = (line for lines in edge_lines(compact, edge_symbol) for line in lines)
 
-    max_red = max(reds.values(), default=1)
-    reds = {k:255*v/max_red for k,v in reds.items()}
-
-    max_green = max(greens.values(), default=1)
-    greens = {k:255*v/max_green for k,v in greens.items()}
-
-    max_blue = max(blues.values(), default=1)
-    blues = {k:255*v/max_blue for k,v in blues.items()}
-
-    nodes = {k:(reds[k], greens[k], blues[k]) for k in graph.keys()}
+    nodes = dict(zip(compact.ids.tolist(), map(tuple, node_colours(compact).tolist())))
 
     G.remove_nodes_from([n for n in G.nodes() if node_remp(n, G)])
     G.remove_edges_from([(u, v) for u, v in G.edges() if edge_remp(u, v, G)])
 
     return G, nodes, edges
 
+MORTON_MASKS = [(16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                (2, 0x3333333333333333), (1, 0x5555555555555555)]
+
+def morton_codes(cx, cy):
+    """
+    Return the Morton codes of cells `(cx, cy)`, interleaving bits of their coordinates;
+    sorted by them, points of any cell of any coarser grid are contiguous.
+    """
+    def spread(v):
+        for shift, mask in MORTON_MASKS:
+            v = (v | (v << shift)) & mask
+        return v
+    return (spread(cx) << 1) | spread(cy)
+
+def barnes_hut_forces(xy, k, exact=4, max_levels=30):
+    """
+    Return the Fruchterman-Reingold repulsion on each point of `xy`, approximated
+    on a pyramid of grids, as Barnes-Hut does on a quadtree.
+
+    At each level, a point is repelled by centres of mass of cells that are not
+    adjacent to its own cell but whose parents are adjacent to its parent, until
+    the level where adjacent cells hold `exact` points at most, which repel it one
+    by one. So every pair of points is accounted once, and forces cost `O(n log n)`
+    instead of `O(n²)`; as in a quadtree, only points around crowded cells go down
+    finer grids, whose occupied cells only are kept, looked up by Morton code.
+
+    Points also stop where adjacent cells are closer than the `0.01 * k` floor of
+    distances, since there repulsion is linear and their centres of mass are exact,
+    and after `max_levels` levels.
+    """
+    n = len(xy)
+    side = 2 ** max_levels
+    low = xy.min(axis=0)
+    extent = max((xy.max(axis=0) - low).max(), 1e-12)
+    fx, fy = np.minimum((xy - low) * (side / extent), side - 1).astype(np.int64).T
+
+    # points sorted along the Z curve, so that cells of every grid are ranges of them
+    codes = morton_codes(fx, fy)
+    order = np.argsort(codes, kind='stable')
+    x, y, fx, fy, codes = xy[order, 0], xy[order, 1], fx[order], fy[order], codes[order]
+
+    floor, kk = (0.01 * k) ** 2, k * k
+    fxs, fys = np.zeros(n), np.zeros(n)
+
+    def repel(px, py, gx, gy, masses, cx, cy):
+        dx, dy = px - cx, py - cy
+        f = dx * dx + dy * dy
+        np.maximum(f, floor, out=f)
+        np.divide(masses * kk, f, out=f)
+        np.add(gx, dx * f, out=gx)
+        np.add(gy, dy * f, out=gy)
+
+    active = np.arange(n) # points whose adjacent cells are still crowded
+    for level in range(1, max_levels + 1):
+        width, shift = 2 ** level, max_levels - level
+        keys = codes >> 2 * shift
+        starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]])) # of occupied cells
+        occupied, empty = keys[starts], len(starts)
+        masses = np.diff(np.append(starts, n))
+        mx, my = np.add.reduceat(x, starts) / masses, np.add.reduceat(y, starts) / masses
+        cells = np.repeat(np.arange(empty), masses)[active]
+
+        # a last cell, of no mass, stands for empty ones
+        starts, masses, mx, my = np.append(starts, n), np.append(masses, 0), np.append(mx, 0), np.append(my, 0)
+
+        # cells of active points, where each of them lies
+        own = np.unique(cells)
+        where = np.searchsorted(own, cells)
+        cx, cy = fx[starts[own]] >> shift, fy[starts[own]] >> shift
+
+        # coarse grids are small enough for a table of all their cells, finer ones are searched
+        table = None
+        if width * width <= 4 * n:
+            table = np.full(width * width, empty)
+            table[occupied] = np.arange(empty)
+
+        def neighbours(ox, oy):
+            """
+            Return the cells at offset `(ox, oy)` of cells `own`, `empty` where there is none.
+            """
+            nx_, ny_ = cx + ox, cy + oy
+            outside = (nx_ < 0) | (nx_ >= width) | (ny_ < 0) | (ny_ >= width)
+            wanted = morton_codes(np.clip(nx_, 0, width - 1), np.clip(ny_, 0, width - 1))
+            if table is not None:
+                at = table[wanted]
+            else:
+                at = np.minimum(np.searchsorted(occupied, wanted), empty - 1)
+                at[occupied[at] != wanted] = empty
+            at[outside] = empty
+            return at
+
+        px, py, gx, gy = x[active], y[active], np.zeros(len(active)), np.zeros(len(active))
+        parity = (2 * (cx & 1) + (cy & 1))[where]
+        for ox in range(-2, 4):
+            for oy in range(-2, 4):
+                apart = np.array([abs(ox - bx) > 1 or abs(oy - by) > 1 for bx in (0, 1) for by in (0, 1)])
+                if apart.any():
+                    at = neighbours(ox - (cx & 1), oy - (cy & 1))[where] # from the corner of the parent cell
+                    repel(px, py, gx, gy, masses[at] * apart[parity], mx[at], my[at])
+
+        adjacent = {(ox, oy): neighbours(ox, oy) for ox in range(-1, 2) for oy in range(-1, 2)}
+        if level == max_levels or 3 * math.sqrt(2) * extent / width <= 0.01 * k:
+            done = np.ones(len(active), dtype=bool)
+        else:
+            done = (np.max([masses[at] for at in adjacent.values()], axis=0) <= exact)[where]
+
+        points, px, py, ex, ey = active[done], px[done], py[done], gx[done], gy[done]
+        for (ox, oy), at in adjacent.items():
+            at = at[where[done]]
+            first, counts = starts[at], masses[at]
+            rest, sx, sy = counts.astype(float), mx[at] * counts, my[at] * counts
+            for j in range(min(exact, counts.max(initial=0))):
+                taken = j < counts
+                member = np.where(taken, first + j, 0)
+                repel(px, py, ex, ey, (taken & (member != points)).astype(float), x[member], y[member])
+                rest -= taken
+                sx -= x[member] * taken
+                sy -= y[member] * taken
+            if ox == 0 and oy == 0: # the point itself may be among the rest
+                beyond = points - first >= exact
+                rest -= beyond
+                sx -= px * beyond
+                sy -= py * beyond
+            if rest.any():
+                weights = np.maximum(rest, 1)
+                repel(px, py, ex, ey, rest, sx / weights, sy / weights)
+
+        fxs[points] += ex
+        fys[points] += ey
+        active = active[~done]
+        fxs[active] += gx[~done]
+        fys[active] += gy[~done]
+        if not len(active): break
+
+    forces = np.empty_like(xy)
+    forces[order, 0], forces[order, 1] = fxs, fys
+    return forces
+
+def edge_indices(G, nodes):
+    """
+    Return the pair of arrays of positions in `nodes` of sources and targets of edges of `G`.
+    """
+    index = {node: i for i, node in enumerate(nodes)}
+    ends = np.fromiter((index[v] for e in G.edges() for v in e), dtype=np.int64, count=2 * G.number_of_edges())
+    return ends[0::2], ends[1::2]
+
+def barnes_hut_layout(G, iterations=50, seed=None, gravity=1.0):
+    """
+    Return the mapping from nodes of `G` to positions of a Fruchterman-Reingold
+    layout whose repulsion is `barnes_hut_forces`, after `iterations` steps, each
+    one costing `O(n log n + m)`; so it scales to graphs of whole caches.
+
+    Nodes are pulled to their centre of mass proportionally to `gravity`, which
+    keeps small components from drifting away: against repulsion, it settles
+    a uniform disc of radius `1 / sqrt(gravity)`.
+    """
+    nodes = list(G)
+    n = len(nodes)
+    if not n: return {}
+
+    sources, targets = edge_indices(G, nodes)
+
+    xy = np.random.default_rng(seed).random((n, 2))
+    k = math.sqrt(1.0 / n)
+    t = 0.1
+    dt = t / (iterations + 1)
+
+    for _ in range(iterations):
+        displacement = barnes_hut_forces(xy, k)
+        displacement -= gravity * (xy - xy.mean(axis=0))
+
+        delta = xy[sources] - xy[targets]
+        pulls = delta * (np.sqrt((delta ** 2).sum(axis=1)) / k)[:, None]
+        for axis in range(2):
+            displacement[:, axis] -= np.bincount(sources, weights=pulls[:, axis], minlength=n)
+            displacement[:, axis] += np.bincount(targets, weights=pulls[:, axis], minlength=n)
+
+        lengths = np.maximum(np.sqrt((displacement ** 2).sum(axis=1)), 1e-12)
+        xy += displacement * (np.minimum(lengths, t) / lengths)[:, None]
+        t -= dt
+
+    return dict(zip(nodes, xy))
+
+def spring_layout(G, iterations=50, seed=None, exact_limit=1000):
+    """
+    Return the networkx Fruchterman-Reingold layout of `G`, if it has `exact_limit`
+    nodes at most, otherwise the `barnes_hut_layout` one.
+    """
+    if len(G) <= exact_limit:
+        return nx.fruchterman_reingold_layout(G, iterations=iterations, seed=seed)
+    return barnes_hut_layout(G, iterations=iterations, seed=seed)
+
 def draw_nx_graph(  G, nodes_colors={},
                     filename=None, nodes_labels={}, dpi=600,
-                    layout=lambda l: l.shell_layout):
+                    layout=lambda l: l.shell_layout, layout_kwds={},
+                    rasterized=False):
+    """
+    Draw `G` with a single collection of nodes, a single path of edges, unless they
+    have arrows, and texts for labelled nodes only; if `rasterized`, nodes and edges
+    are drawn as bitmaps even in vector formats, nodes shrink beyond a thousand ones
+    and edges are thin, not antialiased and without arrows, which keeps drawing
+    graphs of whole caches feasible.
+    """
 
     import matplotlib.pyplot as plt
 
-    if 'draw' not in nodes_labels: nodes_labels['draw'] = True
-
-    nc = defaultdict(lambda: 'gray')
-    nc.update(nodes_colors)
+    from matplotlib.path import Path
+    from matplotlib.patches import PathPatch
 
     l = layout(nx.layout)
-    pos = l(G)
+    pos = l(G, **layout_kwds)
 
+    nodes = list(G)
     degrees = G.in_degree() if G.is_directed() else G.degree()
-    for seq_id in G.nodes():
-        nx.draw_networkx_nodes(G, pos, nodelist=[seq_id],
-                               node_color=nc[seq_id],
-                               node_size=degrees[seq_id]*10,
-                               alpha=0.8)
-
-    nx.draw_networkx_edges(G,pos,width=1.0,alpha=0.5)
-
-    if nodes_labels['draw']:
-        ls = {n:nodes_labels[n] if n in nodes_labels else ''
-              for n in G.nodes()}
+    scale = 10 * min(1, 1000 / len(G)) if rasterized and len(G) else 10
+    collection = nx.draw_networkx_nodes(G, pos, nodelist=nodes,
+                                        node_color=[nodes_colors.get(n, 'gray') for n in nodes],
+                                        node_size=[degrees[n]*scale for n in nodes],
+                                        alpha=0.8, linewidths=0 if rasterized else None)
+    collection.set_rasterized(rasterized)
+
+    if G.is_directed() and not rasterized:
+        nx.draw_networkx_edges(G, pos, width=1.0, alpha=0.5, arrows=True)
+    elif G.number_of_edges():
+        xy = np.array([pos[n] for n in nodes])
+        sources, targets = edge_indices(G, nodes)
+        vertices = np.stack([xy[sources], xy[targets]], axis=1).reshape(-1, 2)
+        codes = np.tile([Path.MOVETO, Path.LINETO], G.number_of_edges())
+        edges = PathPatch(Path(vertices, codes), fill=False, edgecolor='k', alpha=0.5,
+                          linewidth=0.1 if rasterized else 1.0, zorder=1,
+                          antialiased=not rasterized, rasterized=rasterized)
+        # `add_artist` rather than `add_patch`, which would walk every segment to update limits
+        plt.gca().add_artist(edges)
+
+    if nodes_labels.get('draw', True):
+        ls = {n: label for n, label in nodes_labels.items() if n != 'draw' and n in G}
         nx.draw_networkx_labels(G,pos,ls,font_size=16)
 
     plt.axis('off')
-    if filename: plt.savefig(filename, dpi=dpi)
-    else: plt.show()
+    # Agg strokes long paths a chunk of segments at a time; `plt.savefig` would draw twice
+    with plt.rc_context({'agg.path.chunksize': 10000} if rasterized else {}):
+        if filename: plt.gcf().savefig(filename, dpi=dpi)
+        else: plt.show()
 
 
 # argument parsing {{{
@@ -126,7 +529,9 @@ def handle_cli_arguments():
         elif l == 'SHELL':
             layout_selector = lambda l: l.shell_layout
         elif l == 'FRUCHTERMAN-REINGOLD' or l == 'SPRING':
-            layout_selector = lambda l: l.fruchterman_reingold_layout
+            layout_selector = lambda l: spring_layout
+        elif l == 'BARNES-HUT':
+            layout_selector = lambda l: barnes_hut_layout
         elif l == 'SPECTRAL':
             layout_selector = lambda l: l.spectral_layout
         else:
@@ -145,8 +550,14 @@ def handle_cli_arguments():
                         default='./graphs/')
     parser.add_argument("--dpi", help="Resolution in DPI (defaults to 600)",
                         default=600, type=int)
-    parser.add_argument("--layout", help="Graph layout, choose from: {RANDOM, CIRCULAR, SHELL, FRUCHTERMAN-REINGOLD, SPRING, SPECTRAL} (defaults to SHELL)",
+    parser.add_argument("--layout", help="Graph layout, choose from: {RANDOM, CIRCULAR, SHELL, FRUCHTERMAN-REINGOLD, SPRING, BARNES-HUT, SPECTRAL} (defaults to SHELL)",
                         default='SHELL', type=layout_type,)
+    parser.add_argument("--iterations", metavar='N', help="Steps of SPRING and BARNES-HUT layouts (defaults to 50)",
+                        default=50, type=int)
+    parser.add_argument("--draw", help="Draw the graph in image F, instead of writing its edges and coloured labels (defaults to False)",
+                        action="store_true")
+    parser.add_argument("--raster", help="Draw nodes and edges as bitmaps, for graphs of whole caches (defaults to False)",
+                        action="store_true")
 
     args = parser.parse_args()
     return args
@@ -159,21 +570,10 @@ if __name__ == "__main__":
 
     args = handle_cli_arguments()
 
-    docs = commons.cache_reify(args.cache_dir)
-
-    graph = adjust_crossreferences(docs)
-
-    nxgraph, nodes, edges = make_nx_graph(graph, digraph=args.directed, )
-
-    labels = []
-    for node, color in nodes.items():
-        r, g, b = color 
-        c = math.floor((.3*r + .59*g + .11*b) / 1)
-        labels.append("{} {{ color:#{:02X}{:02X}{:02X} }}".format(
-            node, math.floor(255-r), math.floor(255-g), math.floor(255-b)))
-            #node, math.floor(255-c), math.floor(255-c), math.floor(255-c)))
+    graph = graph_load(args.cache_dir, compact=True)
 
     if False:
+        nxgraph = graph.to_networkx(digraph=args.directed)
         cc = nx.strongly_connected_components(nxgraph)
         #cc = nx.dominating_set(nxgraph, start_with='A000045')
         #cc = nx.find_cliques(nxgraph)
@@ -184,10 +584,16 @@ if __name__ == "__main__":
             for node in c:
                 nodes.append("{} {{ color:#{} }}".format(node, color))
 
-    with open(args.graphs_dir + args.filename, "w") as f:
-        f.write("-> { color: #ffffff }\n")
-        f.write("\n".join(edges + labels))
-
-    #draw_nx_graph(nxgraph, filename=args.graphs_dir + args.filename, layout=args.layout)
+    if args.draw:
+        nxgraph = graph.to_networkx(digraph=args.directed)
+        colours = dict(zip(graph.ids.tolist(), map(tuple, (node_colours(graph) / 255).tolist())))
+        iterative = args.layout(nx.layout) in (spring_layout, barnes_hut_layout)
+        draw_nx_graph(nxgraph, colours, filename=args.graphs_dir + args.filename,
+                      nodes_labels={'draw': False}, dpi=args.dpi, layout=args.layout,
+                      layout_kwds={'iterations': args.iterations} if iterative else {},
+                      rasterized=args.raster)
+    else:
+        with open(args.graphs_dir + args.filename, "w", buffering=2**20) as f:
+            write_graph(graph, f)
 
 # }}}
@@ -0,0 +1,161 @@
+import gzip
+
+from itertools import islice
+
+from commons import Axxxxxx_regex, open_index
+from storing import open_storage, frontier_journal
+
+# dump readers {{{
+
+def open_dump(filename):
+    opener = gzip.open if filename.endswith('.gz') else open
+    return opener(filename, 'rt', encoding='utf8')
+
+def stripped_lines(filename):
+    """
+    Iterate over `(seq_id, data)` pairs of an OEIS `stripped` dump, whose lines look like `A000045 ,0,1,1,2,`.
+    """
+    with open_dump(filename) as f:
+        for line in f:
+            if line.startswith('#') or not line.strip(): continue
+            seq_id, _, terms = line.partition(' ')
+            if Axxxxxx_regex.match(seq_id):
+                yield seq_id, terms.strip().strip(',')
+
+def names_lines(filename):
+    """
+    Iterate over `(seq_id, name)` pairs of an OEIS `names` dump, whose lines look like `A000045 Fibonacci numbers...`.
+    """
+    with open_dump(filename) as f:
+        for line in f:
+            if line.startswith('#') or not line.strip(): continue
+            seq_id, _, name = line.partition(' ')
+            if Axxxxxx_regex.match(seq_id):
+                yield seq_id, name.strip()
+
+def merge_dumps(stripped, names):
+    """
+    Join the two dumps, both sorted by A-number, yielding `(seq_id, data, name)` triples;
+    a missing counterpart is `None`.
+    """
+    stripped, names = iter(stripped), iter(names)
+    s, n = next(stripped, None), next(names, None)
+    while s or n:
+        if n is None or (s and s[0] < n[0]):
+            yield s[0], s[1], None
+            s = next(stripped, None)
+        elif s is None or n[0] < s[0]:
+            yield n[0], None, n[1]
+            n = next(names, None)
+        else:
+            yield s[0], s[1], n[1]
+            s, n = next(stripped, None), next(names, None)
+
+def make_partial_doc(seq_id, data, name, previous=None):
+    """
+    Return the partial document of `seq_id`, taking `data` and `name` left `None`
+    by the dumps from `previous`, the partial document of an earlier import.
+    """
+    kept = ((previous or {}).get('results') or [{}])[0]
+    result = {'number': int(seq_id[1:]),
+              'name': kept.get('name', '') if name is None else name,
+              'data': kept.get('data', '') if data is None else data,
+              'keyword': ''}
+    return {'partial': True, 'query': 'id:{}'.format(seq_id), 'count': 1, 'start': 0, 'results': [result]}
+
+# }}}
+
+# importing {{{
+
+def bulk_import(cache_dir, stripped=None, names=None, batch_size=1000, progress_mark=None):
+    """
+    Populate the cache in `cache_dir` from OEIS `stripped` and `names` dump files.
+
+    Dumps are streamed and merged on the fly, while documents are stored and
+    indexed (term store included) in batches of `batch_size`, so memory doesn't
+    grow with dumps sizes. Imported documents are marked as `partial`, hence the
+    crawler fetches them in full on `--restart`; documents already in the cache
+    are updated only if partial themselves, keeping fields of dumps imported
+    before, so `stripped` and `names` can be imported one at a time. Return the
+    numbers of imported and skipped sequences.
+    """
+    storage, index = open_storage(cache_dir), open_index(cache_dir)
+
+    # a crawl journal, if any, has to know that imported sequences are to be fetched in full
+    journal = frontier_journal(cache_dir)
+    if journal.exists(): journal.load()
+
+    triples = merge_dumps(stripped_lines(stripped) if stripped else [],
+                          names_lines(names) if names else [])
+
+    imported, skipped = 0, 0
+
+    while True:
+        batch = list(islice(triples, batch_size))
+        if not batch: break
+
+        stored = []
+        for seq_id, data, name in batch:
+            previous = storage.get(seq_id) if storage.stamp(seq_id) else None
+            if previous and not previous.get('partial', False):
+                skipped += 1
+                continue
+
+            doc = make_partial_doc(seq_id, data, name, previous)
+            stored.append((seq_id, doc, storage.put(seq_id, doc)))
+
+        index.record_many(stored)
+        imported += len(stored)
+
+        if journal.exists():
+            for seq_id, *_ in stored: journal.enqueued(seq_id)
+
+        if progress_mark:
+            print(progress_mark, end='', flush=True)
+
+    journal.close()
+
+    return imported, skipped
+
+# }}}
+
+# argument parsing {{{
+
+def handle_cli_arguments():
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='OEIS dumps importer.')
+
+    parser.add_argument("--stripped", help="Terms dump file, as https://oeis.org/stripped.gz (optionally gzipped)")
+    parser.add_argument("--names", help="Names dump file, as https://oeis.org/names.gz (optionally gzipped)")
+    parser.add_argument("--cache-dir", help="Cache directory (defaults to ./fetched/)",
+                        default='./fetched/')
+    parser.add_argument("--batch-size", help="Sequences stored and indexed at once (defaults to 1000)",
+                        type=int, default=1000)
+    parser.add_argument("--progress-mark", help="Symbol for imported batch event (defaults to ●)",
+                        default='●')
+
+    args = parser.parse_args()
+    if not (args.stripped or args.names):
+        parser.error('at least one of --stripped and --names is required')
+    return args
+
+# }}}
+
+# main {{{
+
+if __name__ == "__main__":
+
+    args = handle_cli_arguments()
+
+    imported, skipped = bulk_import(args.cache_dir,
+                                    stripped=args.stripped,
+                                    names=args.names,
+                                    batch_size=args.batch_size,
+                                    progress_mark=args.progress_mark)
+
+    print('\n{} sequences imported in cache {}, {} already fetched in full have been kept'.format(
+        imported, args.cache_dir, skipped))
+
+# }}}
@@ -0,0 +1,480 @@
+import os, re, json, sqlite3, math, time, heapq
+
+from collections import Counter, defaultdict
+
+from storing import term_store, xref_sidecar, parse_terms, contains_run, open_storage
+
+# preamble {{{
+
+INDEX_FILENAME = '.index.sqlite'
+
+# bump this number whenever the schema below changes: the index holds
+# derived data only, hence an outdated one is simply dropped and rebuilt.
+SCHEMA_VERSION = 6
+
+# fields of the first result copied in the index, so that they can be
+# scanned over the whole cache without decoding any document; list-valued
+# ones (as `xref`) are stored as JSON text.
+PROJECTED_FIELDS = ['name', 'keyword', 'data', 'xref', 'author', 'time', 'revision']
+
+SCHEMA = [
+    '''create table if not exists sequences (
+            id text primary key,
+            path text not null,
+            mtime real not null,
+            size integer not null,
+            {})'''.format(', '.join(PROJECTED_FIELDS)),
+    # posting lists: single terms and windows of `GRAM_LENGTH` consecutive terms
+    'create table if not exists terms (term text, id text, primary key (term, id)) without rowid',
+    'create index if not exists terms_by_id on terms (id)',
+    'create table if not exists grams (gram text, id text, primary key (gram, id)) without rowid',
+    'create index if not exists grams_by_id on grams (id)',
+    # full-text posting lists: occurrences `tf` of `word` in `field` of sequence `id`
+    '''create table if not exists words (
+            word text, id text, field text, tf integer,
+            primary key (word, id, field)) without rowid''',
+    'create index if not exists words_by_id on words (id)',
+    # access times recorded by ourselves, since `atime` isn't updated on `noatime` mounts
+    'create table if not exists accesses (id text primary key, accessed real not null)',
+    # times sequences have been fetched again and found unchanged, hence not rewritten;
+    # losing them on a rebuild just makes those sequences look older than they are
+    'create table if not exists checks (id text primary key, checked real not null)',
+]
+
+GRAM_LENGTH = 3
+
+# sections whose sizes are kept in the xrefs sidecar, for colouring graphs
+COUNTED_FIELDS = ['comment', 'formula', 'reference', 'link']
+
+xref_regex = re.compile(r'A\d{6}')
+
+# intersecting more posting lists than this doesn't shrink candidates appreciably
+MAX_POSTINGS = 32
+
+def split_terms(data):
+    """
+    Return the list of terms in the `data` string of a sequence, normalized as strings.
+    """
+    return [t for t in (data or '').replace(' ', '').split(',') if t]
+
+def windows(terms, k=GRAM_LENGTH):
+    return {','.join(terms[i:i+k]) for i in range(len(terms) - k + 1)}
+
+# fields indexed for full-text queries, with their weights in ranking; `author`
+# is indexed only to answer `author:` clauses and doesn't match free words.
+TEXT_FIELDS = {'name': 3.0, 'keyword': 2.0, 'xref': 1.0, 'formula': 1.0, 'comment': 1.0, 'author': 0.0}
+
+word_regex = re.compile(r'[a-z0-9]+')
+
+def tokenize(text):
+    return word_regex.findall(text.lower())
+
+def words_of(doc):
+    """
+    Return a `Counter` of `(word, field)` occurrences in the first result of `doc`.
+    """
+    result = doc['results'][0] if doc.get('results') else {}
+    words = Counter()
+    for field in TEXT_FIELDS:
+        content = result.get(field, [])
+        for line in [content] if isinstance(content, str) else content:
+            words.update((w, field) for w in tokenize(line))
+    return words
+
+def projection(doc):
+    """
+    Return the values of `PROJECTED_FIELDS` in the first result of `doc`, as stored in its row.
+    """
+    result = doc['results'][0] if doc.get('results') else {}
+    return [json.dumps(v) if isinstance(v, list) else v
+            for f in PROJECTED_FIELDS
+            for v in [result.get(f, None)]]
+
+def adjacency_of(doc):
+    """
+    Return the `(keyword, counts, references)` triple of the first result of `doc`
+    kept by the xrefs sidecar: sizes of `COUNTED_FIELDS` and cross-referenced ids.
+    """
+    result = doc['results'][0] if doc.get('results') else {}
+    counts = tuple(len(result.get(f, [])) for f in COUNTED_FIELDS)
+    references = sorted({r for line in result.get('xref', []) for r in xref_regex.findall(line)})
+    return result.get('keyword', ''), counts, references
+
+def digest(doc):
+    """
+    Return what the index keeps of `doc`, namely the triple of its `projection`,
+    its `words_of` and its `adjacency_of`; computing it needs no index at all, so
+    it can happen elsewhere (in a worker process, say) and be recorded by `record_digested`.
+    """
+    return projection(doc), words_of(doc), adjacency_of(doc)
+
+query_regex = re.compile(r'(?:(?P<key>keyword|author|xref|id):)?(?P<value>\S+)')
+
+# exclusions, phrases, alternatives, lists of terms and any other prefix
+unsupported_query_regex = re.compile(r'(?:^|\s)-|"|\||,|(?:^|\s)(?!(?:keyword|author|xref|id):)\w+:')
+
+def parse_query(query):
+    """
+    Split an OEIS-like `query` into `(key, words)` clauses, where `key` is `None` for free words;
+    return `None` if `query` uses syntax outside the supported subset.
+    """
+    if unsupported_query_regex.search(query): return None
+    return [(m.group('key'), tokenize(m.group('value'))) for m in query_regex.finditer(query)]
+
+# }}}
+
+# INDEX {{{
+
+class cache_index:
+    """
+    A persistent index, keyed by A-number, of the sequences stored in a cache directory.
+
+    Each row records where a sequence lives and its `mtime` as reported by the
+    storage backend of the cache at indexing time, so that a single lookup
+    touches exactly one document and a refresh re-reads only the documents that
+    have been written or modified since.
+    Moreover, a few fields of each sequence are copied in its row, in order to
+    scan them over the whole cache without decoding any document at all; the
+    same holds for its terms, kept in a `term_store`, and its cross references,
+    kept in a `xref_sidecar`.
+    """
+
+    def __init__(self, cache_dir, filename=INDEX_FILENAME):
+        self.cache_dir = cache_dir
+        self.filename = os.path.join(cache_dir, filename)
+        self.storage = open_storage(cache_dir)
+        # rows may be written by a thread other than the opening one, one at a time
+        self.connection = sqlite3.connect(self.filename, check_same_thread=False)
+        self.connection.execute('pragma journal_mode=wal')
+        self.connection.execute('pragma synchronous=normal')
+        self.terms = term_store(cache_dir)
+        self.xrefs = xref_sidecar(cache_dir)
+        if self.ensure_schema():
+            self.terms.clear()
+            self.xrefs.clear()
+            self.refresh()
+            return
+        if len(self.terms) < len(self):
+            # an older cache, or one whose store went missing: fill in the gaps only,
+            # since other processes may be appending to it right now
+            self.terms.append((seq_id, parse_terms(p['data'])) for seq_id, p in self.project(['data'])
+                              if seq_id not in self.terms)
+        if not self.xrefs.exists() and len(self):
+            self.xrefs.append((seq_id,) + adjacency_of(self.storage.get(seq_id) or {}) for seq_id in self.ids())
+
+    def ensure_schema(self):
+        """
+        Create the schema, returning `True` if the index has been (re)built from scratch.
+        """
+        version, = self.connection.execute('pragma user_version').fetchone()
+        with self.connection as c:
+            if version != SCHEMA_VERSION:
+                for table, in c.execute("select name from sqlite_master where type='table'").fetchall():
+                    c.execute('drop table {}'.format(table))
+                c.execute('pragma user_version={}'.format(SCHEMA_VERSION))
+            for statement in SCHEMA:
+                c.execute(statement)
+        return version != SCHEMA_VERSION
+
+    def path_of(self, seq_id):
+        return self.storage.path_of(seq_id)
+
+    def __contains__(self, seq_id):
+        row = self.connection.execute('select 1 from sequences where id=?', (seq_id,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        count, = self.connection.execute('select count(*) from sequences').fetchone()
+        return count
+
+    def ids(self):
+        return [seq_id for seq_id, in self.connection.execute('select id from sequences order by id')]
+
+    def project(self, fields):
+        """
+        Iterate over `(seq_id, {field: value, ...})` pairs for each indexed sequence,
+        reading `fields` (a sublist of `PROJECTED_FIELDS`) from the index only.
+        """
+        unknown = set(fields) - set(PROJECTED_FIELDS)
+        if unknown:
+            raise ValueError('Fields {} are not kept in the index'.format(unknown))
+
+        query = 'select {} from sequences order by id'.format(', '.join(['id'] + list(fields)))
+        for seq_id, *values in self.connection.execute(query):
+            yield seq_id, {f: json.loads(v) if f == 'xref' and v is not None else v
+                           for f, v in zip(fields, values)}
+
+    def lookup(self, seq_id, touch=False):
+        """
+        Return the document for sequence `seq_id`, or `None` if it isn't cached.
+
+        Only the document of `seq_id` is stat-ed and parsed; its row is re-recorded
+        if it changed behind our back. If `touch` is true, the access is recorded
+        for ranking by `most_recents`.
+        """
+        row = self.connection.execute('select mtime from sequences where id=?', (seq_id,)).fetchone()
+        stamp = self.storage.stamp(seq_id)
+        doc = self.storage.get(seq_id) if stamp else None
+
+        if doc is None:
+            if row: self.forget(seq_id)
+            return None
+
+        if not row or row[0] != stamp.mtime:
+            self.record(seq_id, doc, stamp)
+
+        if touch:
+            with self.connection as c:
+                c.execute('insert or replace into accesses values (?, ?)', (seq_id, time.time()))
+
+        return doc
+
+    def entry(self, seq_id, doc, stamp):
+        return self.digested_entry(seq_id, digest(doc), stamp)
+
+    def digested_entry(self, seq_id, digested, stamp):
+        projected, words, adjacency = digested
+        return [seq_id, stamp.path, stamp.mtime, stamp.size] + projected, words, adjacency
+
+    def upsert(self, c, entries):
+        rows = [row for row, _, _ in entries]
+        placeholders = ', '.join('?' * (4 + len(PROJECTED_FIELDS)))
+        c.executemany('insert or replace into sequences values ({})'.format(placeholders), rows)
+
+        # posting lists are kept up to date incrementally, rebuilding those of `rows` only
+        data_at = 4 + PROJECTED_FIELDS.index('data')
+        self.remove_postings(c, [row[0] for row in rows])
+        for row in rows:
+            seq_id, terms = row[0], split_terms(row[data_at])
+            c.executemany('insert or ignore into terms values (?, ?)', [(t, seq_id) for t in set(terms)])
+            c.executemany('insert into grams values (?, ?)', [(g, seq_id) for g in windows(terms)])
+
+        for row, words, _ in entries:
+            c.executemany('insert into words values (?, ?, ?, ?)',
+                          [(w, row[0], field, tf) for (w, field), tf in words.items()])
+
+        self.terms.append((row[0], parse_terms(row[data_at])) for row in rows)
+        self.xrefs.append((row[0],) + tuple(adjacency) for row, _, adjacency in entries)
+
+    def remove_postings(self, c, ids):
+        for table in ['terms', 'grams', 'words', 'accesses', 'checks']:
+            c.executemany('delete from {} where id=?'.format(table), [(seq_id,) for seq_id in ids])
+
+    def remove(self, c, ids):
+        c.executemany('delete from sequences where id=?', [(seq_id,) for seq_id in ids])
+        self.remove_postings(c, ids)
+        self.terms.append((seq_id, None) for seq_id in ids if seq_id in self.terms)
+        self.xrefs.append((seq_id, None, None, None) for seq_id in ids)
+
+    def record(self, seq_id, doc, stamp=None):
+        """
+        Record (or update) the row of sequence `seq_id`, whose content `doc` has been stored as `stamp` tells.
+        """
+        self.record_many([(seq_id, doc, stamp or self.storage.stamp(seq_id))])
+
+    def record_many(self, stored):
+        """
+        Record `(seq_id, doc, stamp)` triples in a single transaction.
+        """
+        with self.connection as c:
+            self.upsert(c, [self.entry(seq_id, doc, stamp) for seq_id, doc, stamp in stored])
+
+    def record_digested(self, stored):
+        """
+        Record `(seq_id, digested, stamp)` triples in a single transaction, where
+        `digested` has been computed by function `digest`.
+        """
+        with self.connection as c:
+            self.upsert(c, [self.digested_entry(seq_id, digested, stamp) for seq_id, digested, stamp in stored])
+
+    def forget(self, seq_id):
+        with self.connection as c:
+            self.remove(c, [seq_id])
+
+    def refresh(self):
+        """
+        Synchronize the index with the cache directory, returning the set of re-indexed ids.
+
+        Only stat informations of the storage backend are used to detect what is
+        changed, so documents already indexed and untouched since aren't read at all.
+        """
+        known = dict(self.connection.execute('select id, mtime from sequences'))
+        stored = set()
+        changed = []
+
+        for seq_id, stamp in self.storage.stamps():
+            stored.add(seq_id)
+            if known.get(seq_id) != stamp.mtime:
+                try:
+                    doc = self.storage.get(seq_id)
+                except ValueError:
+                    continue # a document being written right now, it'll be indexed next time
+                if doc is not None:
+                    changed.append(self.entry(seq_id, doc, stamp))
+
+        with self.connection as c:
+            self.upsert(c, changed)
+            self.remove(c, known.keys() - stored)
+
+        return {row[0] for row, _, _ in changed}
+
+    def postings(self, table, keys):
+        """
+        Return the SQL query selecting ids that appear in the posting lists of *all* `keys`.
+        """
+        column = table[:-1]
+        return ' intersect '.join(['select id from {} where {}=?'.format(table, column)] * len(keys))
+
+    def search_terms(self, seq):
+        """
+        Return the sorted list of ids of sequences containing `seq`, which is either
+        a list of consecutive terms or a set of terms occurring in any order.
+
+        Candidates come from the intersection of (at most `MAX_POSTINGS`) posting
+        lists and are finally checked against their terms in the term store.
+        """
+        terms = [int(t) for t in seq]
+        keys = [str(t) for t in terms]
+
+        if not terms:
+            return self.ids()
+
+        if isinstance(seq, set):
+            table, keys = 'terms', set(keys)
+            matches = lambda stored: set(terms).issubset(stored)
+        else:
+            table, keys = ('grams', windows(keys)) if len(keys) >= GRAM_LENGTH else ('terms', set(keys))
+            matches = lambda stored: contains_run(stored, terms)
+
+        selected = sorted(keys)[:MAX_POSTINGS]
+        query = 'select id, data from sequences where id in ({})'.format(self.postings(table, selected))
+        self.terms.sync() # terms of candidates may have been rewritten by other processes
+        return sorted(seq_id for seq_id, data in self.connection.execute(query, selected)
+                             if matches(self.terms.get(seq_id) or parse_terms(data)))
+
+    def most_recents(self, by='MODIFY', k=None):
+        """
+        Return the ids of the `k` (all, if `None`) most recently accessed (`by='ACCESS'`)
+        or modified (`by='MODIFY'`) sequences, most recent first.
+
+        Only stat informations of the storage backend are used to rank, keeping a
+        heap of size `k`; access times recorded by `lookup` take precedence over `atime`.
+        """
+        accesses = dict(self.connection.execute('select id, accessed from accesses')) if by == 'ACCESS' else {}
+
+        def stamps():
+            for seq_id, stamp in self.storage.stamps():
+                yield (accesses.get(seq_id, stamp.atime) if by == 'ACCESS' else stamp.mtime), seq_id
+
+        ranked = heapq.nlargest(k, stamps()) if k is not None else sorted(stamps(), reverse=True)
+        return [seq_id for _, seq_id in ranked]
+
+    def checked(self, ids, when=None):
+        """
+        Record that sequences `ids` have been found unchanged at time `when` (now, by default).
+        """
+        when = time.time() if when is None else when
+        with self.connection as c:
+            c.executemany('insert or replace into checks values (?, ?)', [(seq_id, when) for seq_id in ids])
+
+    def stale(self, older_than=None, revised_before=None, k=None):
+        """
+        Return the ids of the `k` (all, if `None`) sequences least recently fetched
+        or checked, oldest first, among those fetched or checked more than
+        `older_than` seconds ago and whose OEIS `time` field (an ISO timestamp) is
+        before `revised_before`; sequences without `time`, as partial ones just
+        imported, are always stale, so that `--refresh` completes bulk imports.
+        """
+        query = '''select s.id from sequences s left join checks c on s.id = c.id
+                   where s.time is null
+                      or ((:older_than is null or max(s.mtime, coalesce(c.checked, 0)) < :now - :older_than)
+                          and (:revised_before is null or s.time < :revised_before))
+                   order by max(s.mtime, coalesce(c.checked, 0)), s.id
+                   limit coalesce(:k, -1)'''
+        params = {'older_than': older_than, 'now': time.time(), 'revised_before': revised_before, 'k': k}
+        return [seq_id for seq_id, in self.connection.execute(query, params)]
+
+    def search_text(self, query, start=0, max_results=None):
+        """
+        Return the ids of sequences matching `query`, ranked by relevance and paged
+        by `start` and `max_results`.
+
+        The supported OEIS syntax subset is made of free words, which have to
+        occur in any of the indexed fields, and clauses `keyword:`, `author:`,
+        `xref:` and `id:`; all of them have to be satisfied. Matching sequences
+        are ranked by the tf-idf of free words, weighted by `TEXT_FIELDS`.
+        Return `None` for any other query, which only oeis.org can answer.
+        """
+        clauses = parse_query(query)
+        if clauses is None: return None
+
+        total, = self.connection.execute('select count(*) from sequences').fetchone()
+        matching, scores = None, defaultdict(float)
+
+        for key, words in clauses:
+
+            if key == 'id':
+                hits = {seq_id for seq_id, in self.connection.execute(
+                            'select id from sequences where id=?', (''.join(words).upper(),))}
+                matching = hits if matching is None else matching & hits
+                continue
+
+            for w in words:
+                if key:
+                    postings = self.connection.execute(
+                        'select id, tf from words where word=? and field=?', (w, key)).fetchall()
+                    hits = {seq_id for seq_id, _ in postings}
+                else:
+                    postings = self.connection.execute(
+                        'select id, field, tf from words where word=? and field<>?', (w, 'author')).fetchall()
+                    hits = {seq_id for seq_id, *_ in postings}
+                    idf = math.log(1 + total / (1 + len(hits)))
+                    for seq_id, field, tf in postings:
+                        scores[seq_id] += TEXT_FIELDS[field] * (1 + math.log(tf)) * idf
+
+                matching = hits if matching is None else matching & hits
+
+        ranked = sorted(matching or [], key=lambda seq_id: (-scores[seq_id], seq_id))
+        return ranked[start:start + max_results if max_results else None]
+
+    def close(self):
+        self.connection.close()
+        self.terms.close()
+
+# }}}
+
+# argument parsing {{{
+
+def handle_cli_arguments():
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='OEIS cache indexer.')
+
+    parser.add_argument("--cache-dir", help="Cache directory (defaults to ./fetched/)",
+                        default='./fetched/')
+    parser.add_argument("--compact", help="Drop superseded terms and cross references, kept by the term store and the xrefs sidecar (defaults to False)",
+                        action="store_true", default=False)
+
+    args = parser.parse_args()
+    return args
+
+# }}}
+
+# main {{{
+
+if __name__ == "__main__":
+
+    args = handle_cli_arguments()
+
+    index = cache_index(args.cache_dir)
+    changed = index.refresh()
+
+    if args.compact:
+        index.terms.compact()
+        index.xrefs.compact()
+
+    print('{} sequences indexed in cache {}, {} of them re-indexed'.format(
+        len(index), args.cache_dir, len(changed)))
+
+# }}}
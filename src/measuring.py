@@ -0,0 +1,148 @@
+
+import json, time, asyncio
+
+from contextlib import contextmanager, suppress
+from collections import Counter
+from bisect import bisect_left
+
+# metrics {{{
+
+# upper bounds, in seconds, of histogram buckets
+LATENCY_BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class histogram:
+    """
+    Counts of observed values per bucket, whose upper bounds are `bounds`, plus their sum.
+    """
+
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1) # the last one is unbounded
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, n in zip(self.bounds + (float('inf'),), self.buckets):
+            total += n
+            yield bound, total
+
+    def snapshot(self):
+        return {'count': self.count,
+                'sum': self.sum,
+                'buckets': {str(bound): n for bound, n in self.cumulative()}}
+
+def key_of(name, labels):
+    return name + ('{' + ','.join('{}="{}"'.format(k, v) for k, v in labels) + '}' if labels else '')
+
+class registry:
+    """
+    Counters, gauges and histograms of a running process.
+
+    Counters may carry labels, as in `count('errors', kind='ConnectionResetError')`;
+    gauges are functions, read when a snapshot is taken.
+    """
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self.counters = Counter()
+        self.gauges = {}
+        self.histograms = {}
+        self.last = (time.time(), Counter())
+
+    def count(self, name, n=1, **labels):
+        self.counters[(name, tuple(sorted(labels.items())))] += n
+
+    def value(self, name, **labels):
+        return self.counters[(name, tuple(sorted(labels.items())))]
+
+    def observe(self, name, value):
+        if name not in self.histograms:
+            self.histograms[name] = histogram()
+        self.histograms[name].observe(value)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def gauge(self, name, read):
+        self.gauges[name] = read
+
+    def snapshot(self):
+        """
+        Return a JSON-able view of metrics, with rates per second of counters since the previous call.
+        """
+        now = time.time()
+        since, previous = self.last
+        self.last = (now, self.counters.copy())
+        elapsed = max(now - since, 1e-9)
+        return {'time': now,
+                'counters': {key_of(*k): v for k, v in self.counters.items()},
+                'rates': {key_of(*k): (v - previous[k]) / elapsed for k, v in self.counters.items()},
+                'gauges': {name: read() for name, read in self.gauges.items()},
+                'histograms': {name: h.snapshot() for name, h in self.histograms.items()}}
+
+    def exposition(self):
+        """
+        Return metrics in the Prometheus text format.
+        """
+        lines = []
+        for name in sorted({name for name, _ in self.counters}):
+            lines.append('# TYPE {}{}_total counter'.format(self.prefix, name))
+            lines.extend('{}{} {}'.format(self.prefix, key_of(n + '_total', labels), v)
+                         for (n, labels), v in sorted(self.counters.items()) if n == name)
+        for name, read in sorted(self.gauges.items()):
+            lines.append('# TYPE {}{} gauge'.format(self.prefix, name))
+            lines.append('{}{} {}'.format(self.prefix, name, read()))
+        for name, h in sorted(self.histograms.items()):
+            lines.append('# TYPE {}{} histogram'.format(self.prefix, name))
+            lines.extend('{}{} {}'.format(self.prefix, key_of(name + '_bucket', [('le', '+Inf' if bound == float('inf') else bound)]), n)
+                         for bound, n in h.cumulative())
+            lines.append('{}{}_sum {}'.format(self.prefix, name, h.sum))
+            lines.append('{}{}_count {}'.format(self.prefix, name, h.count))
+        return '\n'.join(lines) + '\n'
+
+# }}}
+
+# reporting {{{
+
+def write_snapshot(metrics, filename):
+    with open(filename, 'a') as f:
+        f.write(json.dumps(metrics.snapshot()) + '\n')
+
+async def write_snapshots(metrics, filename, interval=10.0):
+    """
+    Append a JSON line with a snapshot of `metrics` to file `filename`, every `interval` seconds.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        write_snapshot(metrics, filename)
+
+async def serve(metrics, port, host='127.0.0.1'):
+    """
+    Start answering any HTTP request on `host:port` with the `exposition` of
+    `metrics`, for Prometheus to scrape them; return the server.
+    """
+    async def answer(reader, writer):
+        with suppress(ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            await reader.readuntil(b'\r\n\r\n')
+            body = metrics.exposition().encode('utf8')
+            writer.write(b'HTTP/1.1 200 OK\r\n'
+                         b'Content-Type: text/plain; version=0.0.4\r\n'
+                         b'Content-Length: ' + str(len(body)).encode('ascii') + b'\r\n'
+                         b'Connection: close\r\n\r\n' + body)
+            await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(answer, host, port)
+
+# }}}
@@ -28,7 +28,7 @@ $$
 \end{env}
 $$
         '''
-        start = int(doc['offset'].split(',')[0])
+        start = int(doc.get('offset', '0').split(',')[0])
         nats_header = [str(i) for i in range(start, len(seq))]
         kwds = {
             'env':'{array}', 
@@ -73,7 +73,7 @@ n, k & {nat} \\
 \end{env}
 $$
         '''
-        nats_header = [str(i) for i in range(int(doc['offset'].split(',')[0]), k)]
+        nats_header = [str(i) for i in range(int(doc.get('offset', '0').split(',')[0]), k)]
         kwds = {
             'env': '{array}', 
             'nel': 'c' * (k+1), 
@@ -306,6 +306,8 @@ def search( A_id=None, seq=None, query=None,
 
     query_components = [] # a list of query components, as strings to be joined later
 
+    cache_info = dict(cache_info) # don't leak keys set below into the shared default
+
     if isinstance(A_id, (str, )) and Axxxxxx_regex.match(A_id): 
         query_components.append("id:{}".format(A_id))
         cache_info['id'] = A_id
@@ -320,6 +322,11 @@ def search( A_id=None, seq=None, query=None,
     for r in xref: query_components.append("xref:A{:06d}".format(A_id))
     for k,v in kwds.items(): query_components.append("{}:{}".format(k,v))
 
+    if query:
+        cache_info['query'] = ' '.join(query_components)
+
+    cache_info['max_results'] = max_results
+
     def connection_error(exc):
         return lambda **pp_kwds: Markdown("<hr>__Connection Error__<hr>")
 
@@ -372,8 +379,11 @@ class oeis_results_composer:
 
     def for_notebook(self, nb):
         from IPython.display import Markdown
-        results_description = r"_Results for query: <a href='{url}'>{url}</a>_<br><hr>".format(
-            url=self.GET_result.url)
+        if self.GET_result is None: # answered by the local cache
+            results_description = r"_Results from local cache_<br><hr>"
+        else:
+            results_description = r"_Results for query: <a href='{url}'>{url}</a>_<br><hr>".format(
+                url=self.GET_result.url)
         return Markdown(results_description + "\n<hr>".join(self.results))
 
     def for_console(self, cli):
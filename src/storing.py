@@ -0,0 +1,1003 @@
+import os, mmap, struct, json, time, hashlib, gzip, fcntl, shutil, sqlite3, zlib
+
+from array import array
+from contextlib import suppress, contextmanager
+from collections import OrderedDict, Counter, namedtuple
+
+# preamble {{{
+
+TERMS_FILENAME = '.terms'
+
+INT64_RANGE = range(-2**63, 2**63)
+
+# a record of the `.idx` file: A-number, kind of encoding, offset and length
+# of the terms in the corresponding data file; the latest record of an id wins.
+RECORD = struct.Struct('<7sc2q')
+
+FIXED, BIG, REMOVED = b'q', b'b', b'x'
+
+RESPONSES_DIRNAME = '.responses'
+
+PACKS_DIRNAME = 'packs'
+
+JOURNAL_FILENAME = '.frontier.journal'
+
+SHARED_FRONTIER_FILENAME = '.frontier.sqlite'
+
+XREFS_FILENAME = '.xrefs'
+
+# a record of the packs `index` file: A-number, pack number, offset and length
+# of the compressed document, writing time; a zero length marks a removal.
+PACK_RECORD = struct.Struct('<7sIqId')
+
+# where and when a document has been stored, as far as the index is concerned
+stamp = namedtuple('stamp', ['path', 'mtime', 'size', 'atime'])
+
+# }}}
+
+# STORAGE BACKENDS {{{
+
+class directory_storage:
+    """
+    The plain layout of a cache: one uncompressed `Axxxxxx.json` file per sequence.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def path_of(self, seq_id):
+        return os.path.join(self.cache_dir, seq_id + '.json')
+
+    def stamp(self, seq_id):
+        path = self.path_of(seq_id)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stamp(path, stat.st_mtime, stat.st_size, stat.st_atime)
+
+    def stamps(self):
+        """
+        Iterate over `(seq_id, stamp)` pairs of stored sequences, using `os.scandir` only.
+        """
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                if not (entry.name.endswith('.json') and entry.is_file()): continue
+                stat = entry.stat()
+                yield entry.name[:-len('.json')], stamp(entry.path, stat.st_mtime, stat.st_size, stat.st_atime)
+
+    def ids(self):
+        return [seq_id for seq_id, _ in self.stamps()]
+
+    def get(self, seq_id):
+        try:
+            with open(self.path_of(seq_id), 'r') as handler:
+                return json.load(handler)
+        except FileNotFoundError:
+            return None
+
+    def put_raw(self, seq_id, payload):
+        """
+        Store `payload`, the JSON encoding of a document as bytes, for sequence `seq_id`.
+        """
+        with open(self.path_of(seq_id), 'wb') as f:
+            f.write(payload)
+            f.flush()
+        return self.stamp(seq_id)
+
+    def put(self, seq_id, doc):
+        return self.put_raw(seq_id, json.dumps(doc).encode('utf8'))
+
+    def remove(self, seq_id):
+        with suppress(FileNotFoundError):
+            os.remove(self.path_of(seq_id))
+
+    def destroy(self):
+        for seq_id in self.ids():
+            self.remove(seq_id)
+
+class packed_storage:
+    """
+    A compact layout of a cache: documents are gzip-framed JSON records appended
+    to segment files `packs/NNNNN.pack`, at most `segment_size` bytes each.
+
+    File `packs/index` is an append-only log of `PACK_RECORD`s locating the latest
+    version of every document, read incrementally so that records written by
+    other processes are seen too, and from scratch once `compact` replaced it;
+    writers serialize on an exclusive lock, readers share it, so that no pack is
+    replaced while they read offsets they know.
+    """
+
+    def __init__(self, cache_dir, dirname=PACKS_DIRNAME, segment_size=64*2**20, compresslevel=6):
+        self.cache_dir = cache_dir
+        self.directory = os.path.join(cache_dir, dirname)
+        self.segment_size = segment_size
+        self.compresslevel = compresslevel
+        self.entries = {}
+        self.read_upto = 0
+        self.inode = None
+        self.holding = False
+        os.makedirs(self.directory, exist_ok=True)
+        self.sync()
+
+    def filename(self, name):
+        return os.path.join(self.directory, name)
+
+    def pack_filename(self, pack):
+        return self.filename('{:05d}.pack'.format(pack))
+
+    def path_of(self, seq_id):
+        pack, offset, *_ = self.entries.get(seq_id, (self.current_pack(), 0))
+        return '{}#{}'.format(self.pack_filename(pack), offset)
+
+    @contextmanager
+    def locked(self, operation=fcntl.LOCK_EX):
+        if self.holding: # flock would wait for ourselves through another descriptor
+            yield
+            return
+        # next to the packs directory, which `compact` replaces
+        with open(self.directory + '.lock', 'w') as lock:
+            fcntl.flock(lock, operation)
+            self.holding = True
+            try:
+                yield
+            finally:
+                self.holding = False
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def sync(self):
+        """
+        Read records appended to the index since the last call, reading it from
+        scratch if it has been replaced meanwhile.
+        """
+        try:
+            f = open(self.filename('index'), 'rb')
+        except FileNotFoundError:
+            return
+
+        with f:
+            status = os.fstat(f.fileno()) # of the file being read, even if replaced right now
+            if status.st_ino != self.inode:
+                self.entries.clear()
+                self.read_upto, self.inode = 0, status.st_ino
+
+            size = status.st_size
+            size -= (size - self.read_upto) % PACK_RECORD.size # a record being written right now
+            if size <= self.read_upto: return
+
+            f.seek(self.read_upto)
+            records = f.read(size - self.read_upto)
+
+        for seq_id, pack, offset, length, written in PACK_RECORD.iter_unpack(records):
+            seq_id = seq_id.decode('ascii')
+            if length:
+                self.entries[seq_id] = (pack, offset, length, written)
+            else:
+                self.entries.pop(seq_id, None)
+
+        self.read_upto = size
+
+    def current_pack(self):
+        packs = [int(name[:-len('.pack')]) for name in os.listdir(self.directory) if name.endswith('.pack')]
+        return max(packs, default=0)
+
+    def stamp(self, seq_id):
+        self.sync()
+        if seq_id not in self.entries: return None
+        pack, offset, length, written = self.entries[seq_id]
+        return stamp('{}#{}'.format(self.pack_filename(pack), offset), written, length, written)
+
+    def stamps(self):
+        self.sync()
+        for seq_id in list(self.entries):
+            yield seq_id, self.stamp(seq_id)
+
+    def ids(self):
+        self.sync()
+        return list(self.entries)
+
+    def get_raw(self, seq_id):
+        with self.locked(fcntl.LOCK_SH):
+            self.sync()
+            if seq_id not in self.entries: return None
+            pack, offset, length, _ = self.entries[seq_id]
+            with open(self.pack_filename(pack), 'rb') as f:
+                f.seek(offset)
+                return gzip.decompress(f.read(length))
+
+    def get(self, seq_id):
+        raw = self.get_raw(seq_id)
+        return json.loads(raw.decode('utf8')) if raw is not None else None
+
+    def append_record(self, seq_id, pack, offset, length, written):
+        with open(self.filename('index'), 'ab') as f:
+            f.write(PACK_RECORD.pack(seq_id.encode('ascii'), pack, offset, length, written))
+
+    def put_raw(self, seq_id, payload):
+        """
+        Store `payload`, the JSON encoding of a document as bytes, for sequence `seq_id`.
+        """
+        compressed = gzip.compress(payload, compresslevel=self.compresslevel)
+        with self.locked():
+            pack = self.current_pack()
+            with suppress(FileNotFoundError):
+                if os.path.getsize(self.pack_filename(pack)) >= self.segment_size:
+                    pack += 1
+            with open(self.pack_filename(pack), 'ab') as f:
+                offset = f.tell()
+                f.write(compressed)
+            self.append_record(seq_id, pack, offset, len(compressed), time.time())
+        return self.stamp(seq_id)
+
+    def put(self, seq_id, doc):
+        return self.put_raw(seq_id, json.dumps(doc).encode('utf8'))
+
+    def remove(self, seq_id):
+        with self.locked():
+            self.append_record(seq_id, 0, 0, 0, time.time())
+        self.sync()
+
+    def compact(self):
+        """
+        Rewrite packs keeping the latest version of each document only; other
+        processes wait to read or write meanwhile, then read the new index afresh.
+        """
+        with self.locked():
+            self.sync()
+            fresh = packed_storage(self.cache_dir, dirname=os.path.basename(self.directory) + '.compacting',
+                                   segment_size=self.segment_size, compresslevel=self.compresslevel)
+            for seq_id in sorted(self.entries):
+                fresh.put_raw(seq_id, self.get_raw(seq_id))
+
+            outdated = self.directory + '.outdated'
+            os.rename(self.directory, outdated)
+            os.rename(fresh.directory, self.directory)
+            shutil.rmtree(outdated)
+            os.remove(fresh.directory + '.lock')
+
+            self.sync()
+
+    def destroy(self):
+        shutil.rmtree(self.directory)
+        with suppress(FileNotFoundError):
+            os.remove(self.directory + '.lock')
+
+_storages = {}
+
+def open_storage(cache_dir):
+    """
+    Return the storage backend of `cache_dir`, opening it once per process: a
+    `packed_storage` if the cache has a `packs` directory, a `directory_storage` otherwise.
+    """
+    key = os.path.abspath(cache_dir)
+    if key not in _storages:
+        packed = os.path.isdir(os.path.join(cache_dir, PACKS_DIRNAME))
+        _storages[key] = (packed_storage if packed else directory_storage)(cache_dir)
+    return _storages[key]
+
+def migrate(cache_dir, to):
+    """
+    Convert the cache in `cache_dir` to layout `to`, either `'directory'` or `'packed'`;
+    afterwards, `open_storage` returns the new backend (see also `commons.open_index`).
+    """
+    source = open_storage(cache_dir)
+    target_class = packed_storage if to == 'packed' else directory_storage
+    if isinstance(source, target_class): return 0
+
+    target = target_class(cache_dir)
+    migrated = 0
+    for seq_id in source.ids():
+        target.put(seq_id, source.get(seq_id))
+        migrated += 1
+
+    source.destroy()
+    _storages[os.path.abspath(cache_dir)] = target
+    return migrated
+
+# }}}
+
+# CRAWL JOURNAL {{{
+
+class frontier_journal:
+    """
+    An append-only journal of the crawl state of a cache: a line `+Axxxxxx` tells
+    that a sequence has been fetched, a line `>Axxxxxx` that it joined the frontier
+    and a line `!Axxxxxx` that fetching it has been given up (a dead letter, left
+    out of the frontier until asked for explicitly).
+
+    Loading it costs a pass over short lines, no document is read; every
+    `compact_every` appended lines (never, if `None`), the journal is rewritten
+    to hold just one line per sequence.
+    """
+
+    def __init__(self, cache_dir, compact_every=100000):
+        self.filename = os.path.join(cache_dir, JOURNAL_FILENAME)
+        self.compact_every = compact_every
+        self.seen, self.fringe, self.dead = set(), set(), set()
+        self.appended = 0
+        self.handler = None
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def load(self):
+        """
+        Replay the journal, returning the `(seen, fringe)` pair of sets it describes;
+        dead letters are left in attribute `dead`.
+        """
+        self.seen, self.fringe, self.dead = set(), set(), set()
+        with suppress(FileNotFoundError), open(self.filename, 'r') as f:
+            for line in f:
+                mark, resource = line[:1], line[1:].strip()
+                if mark == '+':
+                    self.seen.add(resource)
+                    self.fringe.discard(resource)
+                    self.dead.discard(resource)
+                elif mark == '>' and resource not in self.seen:
+                    self.fringe.add(resource)
+                    self.dead.discard(resource)
+                elif mark == '!' and resource not in self.seen:
+                    self.dead.add(resource)
+                    self.fringe.discard(resource)
+        return self.seen, self.fringe
+
+    def append(self, mark, resource):
+        if self.handler is None:
+            self.handler = open(self.filename, 'a', buffering=1) # line buffered
+        self.handler.write('{}{}\n'.format(mark, resource))
+        self.appended += 1
+        if self.compact_every and self.appended >= self.compact_every:
+            self.compact()
+
+    def fetched(self, resource):
+        self.seen.add(resource)
+        self.fringe.discard(resource)
+        self.dead.discard(resource)
+        self.append('+', resource)
+
+    def enqueued(self, resource):
+        if resource in self.seen or resource in self.fringe: return
+        self.fringe.add(resource)
+        self.dead.discard(resource)
+        self.append('>', resource)
+
+    def gave_up(self, resource):
+        if resource in self.seen or resource in self.dead: return
+        self.dead.add(resource)
+        self.fringe.discard(resource)
+        self.append('!', resource)
+
+    def reset(self, seen, fringe, dead=()):
+        """
+        Rewrite the journal from scratch to describe `seen`, `fringe` and `dead`.
+        """
+        self.seen = set(seen)
+        self.dead = set(dead) - self.seen
+        self.fringe = set(fringe) - self.seen - self.dead
+        self.compact()
+
+    def compact(self):
+        self.close()
+        with open(self.filename + '.tmp', 'w') as f:
+            f.writelines('+{}\n'.format(resource) for resource in sorted(self.seen))
+            f.writelines('>{}\n'.format(resource) for resource in sorted(self.fringe))
+            f.writelines('!{}\n'.format(resource) for resource in sorted(self.dead))
+        os.replace(self.filename + '.tmp', self.filename)
+        self.appended = 0
+
+    def close(self):
+        if self.handler:
+            self.handler.close()
+            self.handler = None
+
+# }}}
+
+# SHARED FRONTIER {{{
+
+def shard_of(seq_id, shards):
+    return zlib.crc32(seq_id.encode('ascii')) % shards
+
+class frontier_store:
+    """
+    The crawl state of a cache shared by crawlers running at once, possibly on
+    different nodes, each one fetching the ids of its own shard out of `shards`.
+
+    Every id ever referenced has a row in SQLite database `.frontier.sqlite`,
+    whose `state` moves from `queued` to `claimed` (by the crawler of its shard,
+    atomically) to `fetched` or `dead`: since rows are never added twice and a
+    queued row is claimed once, each id is fetched once across all crawlers.
+    Ids referenced by a crawler but belonging to another shard are simply
+    queued here, for their crawler to claim them.
+
+    Rows keep what frontier policies score ids by, namely the least `depth` from
+    the seeds they have been referenced at, their `indegree` and `boost` (the
+    number of references from sequences with boosting keywords), so that ids
+    are claimed in order and with the depth of whoever referenced them.
+    """
+
+    def __init__(self, cache_dir, shards, filename=SHARED_FRONTIER_FILENAME, timeout=60.0):
+        self.filename = os.path.join(cache_dir, filename)
+        self.shards = shards
+        self.connection = sqlite3.connect(self.filename, timeout=timeout, isolation_level=None)
+        self.connection.execute('pragma journal_mode=wal')
+        with self.transaction() as c:
+            c.execute('create table if not exists meta (key text primary key, value)')
+            c.execute('''create table if not exists resources (
+                            id text primary key, shard integer not null,
+                            state text not null, updated real not null,
+                            depth integer not null default 0,
+                            indegree integer not null default 0,
+                            boost integer not null default 0)''')
+            columns = {name for _, name, *_ in c.execute('pragma table_info(resources)').fetchall()}
+            for column in sorted({'depth', 'indegree', 'boost'} - columns): # a frontier of an older crawl
+                c.execute('alter table resources add column {} integer not null default 0'.format(column))
+            c.execute('create index if not exists resources_by_state on resources (state, shard)')
+            c.execute("insert or ignore into meta values ('shards', ?)", (shards,))
+            known, = c.execute("select value from meta where key='shards'").fetchone()
+        if known != shards:
+            raise ValueError('Frontier {} is split in {} shards, not {}'.format(self.filename, known, shards))
+
+    @contextmanager
+    def transaction(self):
+        c = self.connection.cursor()
+        c.execute('begin immediate') # take the write lock at once, other crawlers wait for it
+        try:
+            yield c
+        except BaseException:
+            c.execute('rollback')
+            raise
+        else:
+            c.execute('commit')
+
+    def seed(self, fetched, queued):
+        """
+        Add rows for ids `fetched` already and for `queued` ones, unless they have one.
+        """
+        now = time.time()
+        with self.transaction() as c:
+            for state, ids in [('fetched', fetched), ('queued', queued)]:
+                c.executemany('insert or ignore into resources (id, shard, state, updated) values (?, ?, ?, ?)',
+                              [(seq_id, shard_of(seq_id, self.shards), state, now) for seq_id in ids])
+
+    def add(self, seq_id, depth=0, indegree=0, boost=0):
+        """
+        Queue `seq_id`, referenced at `depth` adding `indegree` and `boost` to its
+        scores, returning `True` if it has never been seen before; a queued one is
+        re-scored only.
+        """
+        with self.transaction() as c:
+            c.execute('''insert or ignore into resources (id, shard, state, updated, depth, indegree, boost)
+                            values (?, ?, ?, ?, ?, ?, ?)''',
+                      (seq_id, shard_of(seq_id, self.shards), 'queued', time.time(), depth, indegree, boost))
+            if c.rowcount > 0: return True
+            c.execute('''update resources set depth=min(depth, ?), indegree=indegree+?, boost=boost+?
+                            where id=? and state='queued' ''', (depth, indegree, boost, seq_id))
+            return False
+
+    def claim(self, shard, seq_id=None, k=1000, max_depth=None, order='updated'):
+        """
+        Claim `seq_id`, or the first `k` queued ids of `shard` by SQL `order` if it
+        is `None`, ignoring those deeper than `max_depth`; return the list of
+        `(seq_id, depth, indegree, boost)` rows claimed.
+        """
+        deepest = max_depth if max_depth is not None else 2**62
+        with self.transaction() as c:
+            if seq_id is not None:
+                c.execute('''update resources set state='claimed', updated=?
+                                where id=? and state='queued' and depth<=?
+                                returning id, depth, indegree, boost''', (time.time(), seq_id, deepest))
+            else:
+                c.execute('''update resources set state='claimed', updated=? where id in (
+                                select id from resources where state='queued' and shard=? and depth<=?
+                                order by {} limit ?) returning id, depth, indegree, boost'''.format(order),
+                          (time.time(), shard, deepest, k))
+            return c.fetchall()
+
+    def mark(self, ids, state):
+        with self.transaction() as c:
+            c.executemany("update resources set state=?, updated=? where id=? and state='claimed'",
+                          [(state, time.time(), seq_id) for seq_id in ids])
+
+    def release(self, ids):
+        """
+        Queue again claimed `ids`, which haven't been fetched.
+        """
+        self.mark(ids, 'queued')
+
+    def gave_up(self, seq_id):
+        self.mark([seq_id], 'dead')
+
+    def settle(self, shard):
+        """
+        Mark as fetched every id claimed by `shard`, whose crawler has nothing left in flight.
+        """
+        with self.transaction() as c:
+            c.execute("update resources set state='fetched', updated=? where state='claimed' and shard=?",
+                      (time.time(), shard))
+
+    def recover(self, shard, fetched):
+        """
+        Fix rows of `shard` left claimed by a crawler that didn't finish: those in
+        `fetched` have been, the others are queued again.
+        """
+        with self.transaction() as c:
+            claimed = [seq_id for seq_id, in c.execute(
+                "select id from resources where state='claimed' and shard=?", (shard,)).fetchall()]
+            c.executemany('update resources set state=? where id=?',
+                          [('fetched' if seq_id in fetched else 'queued', seq_id) for seq_id in claimed])
+
+    def pending(self, max_depth=None):
+        """
+        Return the number of ids queued or claimed, in any shard, ignoring those deeper than `max_depth`.
+        """
+        count, = self.connection.execute(
+            "select count(*) from resources where state in ('queued', 'claimed') and depth<=?",
+            (max_depth if max_depth is not None else 2**62,)).fetchone()
+        return count
+
+    def counts(self, shard=None):
+        """
+        Return the number of ids in each state, of `shard` only if given.
+        """
+        query = 'select state, count(*) from resources {} group by state'.format(
+            'where shard=?' if shard is not None else '')
+        return dict(self.connection.execute(query, () if shard is None else (shard,)))
+
+    def close(self):
+        self.connection.close()
+
+# }}}
+
+# TERM STORE {{{
+
+class term_store:
+    """
+    A memory-mapped store of the parsed terms of every sequence in a cache directory.
+
+    Terms of a sequence live contiguously, as native 64-bit ints in file
+    `.terms.bin` whenever all of them fit, otherwise as comma separated
+    decimals in file `.terms.big`. Accessing a fixed-width sequence returns
+    a zero-copy `memoryview` over the mapped file (wrap it with
+    `numpy.frombuffer` for vectorized work), a big one a tuple of ints.
+
+    The store is append-only: updating a sequence appends its new terms, and
+    `compact` rewrites the files keeping the latest version of each sequence only.
+    As for `packed_storage`, the `.terms.idx` log is read incrementally, so that
+    records appended by other processes are seen too; writers serialize on an
+    exclusive lock, whereas readers take a shared one to map files afresh, since
+    `compact` replaces them.
+    """
+
+    def __init__(self, cache_dir, filename=TERMS_FILENAME):
+        self.cache_dir = cache_dir
+        self.prefix = os.path.join(cache_dir, filename)
+        self.entries = {}
+        self.maps = {}
+        self.read_upto, self.inode = 0, None
+        self.holding = False
+        self.sync()
+
+    def filename(self, suffix):
+        return '{}.{}'.format(self.prefix, suffix)
+
+    @contextmanager
+    def locked(self, operation=fcntl.LOCK_EX):
+        if self.holding: # flock would wait for ourselves through another descriptor
+            yield
+            return
+        with open(self.filename('lock'), 'w') as lock:
+            fcntl.flock(lock, operation)
+            self.holding = True
+            try:
+                yield
+            finally:
+                self.holding = False
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def sync(self):
+        """
+        Read records appended to `.terms.idx` since the last call, reading it
+        from scratch if it has been replaced meanwhile.
+        """
+        try:
+            status = os.stat(self.filename('idx'))
+        except FileNotFoundError:
+            status = None
+
+        inode = status and status.st_ino
+        if inode != self.inode:
+            self.close() # maps of replaced files don't match offsets to come
+            self.entries.clear()
+            self.read_upto, self.inode = 0, inode
+        if status is None: return
+
+        size = status.st_size
+        size -= (size - self.read_upto) % RECORD.size # a record being written right now
+        if size <= self.read_upto: return
+
+        with open(self.filename('idx'), 'rb') as f:
+            f.seek(self.read_upto)
+            records = f.read(size - self.read_upto)
+
+        for seq_id, kind, offset, length in RECORD.iter_unpack(records):
+            seq_id = seq_id.decode('ascii')
+            if kind == REMOVED:
+                self.entries.pop(seq_id, None)
+            else:
+                self.entries[seq_id] = (kind, offset, length)
+
+        self.read_upto = size
+
+    def mapped(self, suffix, end):
+        """
+        Return a read-only map of data file `suffix`, or `None` if the current one ends before `end`.
+        """
+        m = self.maps.get(suffix)
+        return m if m is not None and len(m) >= end else None
+
+    def remap(self, suffix):
+        # the previous map isn't closed: views handed out keep it alive
+        with open(self.filename(suffix), 'rb') as f:
+            self.maps[suffix] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __contains__(self, seq_id):
+        if seq_id not in self.entries: self.sync()
+        return seq_id in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def location(self, seq_id):
+        """
+        Return the map holding the terms of `seq_id` together with its entry.
+        """
+        if seq_id not in self.entries: self.sync()
+        kind, offset, length = self.entries[seq_id]
+        suffix, end = ('bin', offset + length*8) if kind == FIXED else ('big', offset + length)
+
+        m = self.mapped(suffix, end)
+        if m is None:
+            # no `compact` may replace files between reading the log and mapping them
+            with self.locked(fcntl.LOCK_SH):
+                self.sync()
+                kind, offset, length = self.entries[seq_id]
+                suffix = 'bin' if kind == FIXED else 'big'
+                self.remap(suffix)
+                m = self.maps[suffix]
+        return m, (kind, offset, length)
+
+    def __getitem__(self, seq_id):
+        m, (kind, offset, length) = self.location(seq_id)
+
+        if not length:
+            return memoryview(b'').cast('q') if kind == FIXED else ()
+
+        if kind == FIXED:
+            return memoryview(m)[offset:offset + length*8].cast('q')
+
+        return tuple(map(int, m[offset:offset + length].split(b',')))
+
+    def get(self, seq_id, default=None):
+        return self[seq_id] if seq_id in self else default
+
+    def write(self, records, prefix=None):
+        """
+        Append `records` to the files of `prefix` (ours, by default); the caller holds the exclusive lock.
+        """
+        name = lambda suffix: '{}.{}'.format(prefix or self.prefix, suffix)
+        appended = []
+        with open(name('bin'), 'ab') as fixed, open(name('big'), 'ab') as big:
+            # other processes append too, so offsets come from the files as locked
+            ends = {fixed: os.fstat(fixed.fileno()).st_size, big: os.fstat(big.fileno()).st_size}
+            for seq_id, terms in records:
+                if terms is None:
+                    appended.append(RECORD.pack(seq_id.encode('ascii'), REMOVED, 0, 0))
+                    continue
+                if all(t in INT64_RANGE for t in terms):
+                    f, kind, payload, length = fixed, FIXED, array('q', terms).tobytes(), len(terms)
+                else:
+                    payload = ','.join(map(str, terms)).encode('ascii')
+                    f, kind, length = big, BIG, len(payload)
+                appended.append(RECORD.pack(seq_id.encode('ascii'), kind, ends[f], length))
+                f.write(payload)
+                ends[f] += len(payload)
+
+        with open(name('idx'), 'ab') as idx:
+            idx.write(b''.join(appended))
+
+    def append(self, records):
+        """
+        Append `(seq_id, terms)` pairs, where `terms` is a list of ints or `None` to remove `seq_id`.
+        """
+        records = list(records)
+        if not records: return
+        with self.locked():
+            self.write(records)
+            self.sync()
+
+    def put(self, seq_id, terms):
+        self.append([(seq_id, terms)])
+
+    def remove(self, seq_id):
+        if seq_id in self:
+            self.append([(seq_id, None)])
+
+    def replace(self, records):
+        """
+        Replace files with ones holding `records` only; the caller holds the exclusive lock.
+        """
+        replacing = self.prefix + '.replacing'
+        for suffix in ['idx', 'bin', 'big']:
+            with open('{}.{}'.format(replacing, suffix), 'wb'): pass
+        self.write(records, prefix=replacing)
+        # data files first, so that a reader seeing the new log finds them in place
+        for suffix in ['bin', 'big', 'idx']:
+            os.replace('{}.{}'.format(replacing, suffix), self.filename(suffix))
+        self.sync()
+
+    def clear(self):
+        with self.locked():
+            self.replace([])
+
+    def compact(self):
+        """
+        Rewrite the store keeping the latest terms of each live sequence only.
+        """
+        with self.locked():
+            self.sync()
+            self.replace([(seq_id, list(self[seq_id])) for seq_id in sorted(self.entries)])
+
+    def close(self):
+        for m in self.maps.values():
+            with suppress(BufferError): # views still exported, let them release it
+                m.close()
+        self.maps.clear()
+
+def parse_terms(data):
+    """
+    Return the list of ints in the `data` string of a sequence.
+    """
+    return [int(t) for t in (data or '').replace(' ', '').split(',') if t]
+
+def contains_run(terms, run):
+    """
+    Return `True` if list `run` occurs as consecutive terms in `terms`, stored or not.
+    """
+    n = len(run)
+    return any(terms[i] == run[0] and list(terms[i:i+n]) == run
+               for i in range(len(terms) - n + 1))
+
+# }}}
+
+# XREFS SIDECAR {{{
+
+class xref_sidecar:
+    """
+    An append-only text file `.xrefs` of the cross references of every sequence
+    in a cache, so that the graph of a whole cache is built without decoding any
+    document.
+
+    A line `Axxxxxx<TAB>keywords<TAB>counts<TAB>references` describes a sequence
+    as written last, where `counts` and `references` are comma separated (the
+    former are sizes of sections, see `indexing.COUNTED_FIELDS`); a line
+    holding just the A-number tells that the sequence has been removed.
+    """
+
+    def __init__(self, cache_dir, filename=XREFS_FILENAME):
+        self.filename = os.path.join(cache_dir, filename)
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def line(self, seq_id, keyword, counts, references):
+        if counts is None: return '{}\n'.format(seq_id)
+        return '{}\t{}\t{}\t{}\n'.format(seq_id, keyword or '', ','.join(map(str, counts)), ','.join(references))
+
+    @contextmanager
+    def locked(self):
+        """
+        Yield the file, opened for appending and exclusively locked, making sure
+        it is still the current one, since `compact` replaces it.
+        """
+        while True:
+            f = open(self.filename, 'a+')
+            fcntl.flock(f, fcntl.LOCK_EX) # crawlers of a sharded crawl append at once
+            with suppress(FileNotFoundError):
+                if os.fstat(f.fileno()).st_ino == os.stat(self.filename).st_ino: break
+            f.close()
+        with f:
+            yield f
+
+    def append(self, records):
+        """
+        Append `(seq_id, keyword, counts, references)` records, where `counts` is `None` for removed sequences.
+        """
+        lines = ''.join(self.line(*record) for record in records)
+        if not lines: return
+        with self.locked() as f:
+            f.write(lines)
+
+    def records(self, f):
+        records = {}
+        for line in f:
+            if not line.endswith('\n'): break # being written right now
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) == 1:
+                records.pop(fields[0], None)
+                continue
+            seq_id, keyword, counts, references = fields
+            records[seq_id] = (keyword,
+                               tuple(int(c) for c in counts.split(',') if c),
+                               tuple(r for r in references.split(',') if r))
+        return records
+
+    def load(self):
+        """
+        Return a mapping from each sequence to its `(keyword, counts, references)` triple.
+        """
+        with suppress(FileNotFoundError), open(self.filename, 'r') as f:
+            return self.records(f)
+        return {}
+
+    def compact(self):
+        """
+        Rewrite the file keeping the latest line of each live sequence only.
+        """
+        with self.locked() as f:
+            f.seek(0)
+            records = self.records(f)
+            with open(self.filename + '.tmp', 'w') as fresh:
+                fresh.writelines(self.line(seq_id, *record) for seq_id, record in sorted(records.items()))
+            os.replace(self.filename + '.tmp', self.filename)
+
+    def clear(self):
+        with suppress(FileNotFoundError):
+            os.remove(self.filename)
+
+# }}}
+
+# RESPONSE CACHE {{{
+
+def payload_key(payload):
+    """
+    Return a digest of `payload` normalized on its `q`, `start` and `fmt` components.
+    """
+    normalized = {'q': ' '.join(str(payload.get('q', '')).lower().split()),
+                  'start': int(payload.get('start', 0) or 0),
+                  'fmt': payload.get('fmt', 'json')}
+    return hashlib.sha1(json.dumps(normalized, sort_keys=True).encode('utf8')).hexdigest()
+
+class response_cache:
+    """
+    A two-tier cache of oeis.org responses keyed by normalized payloads.
+
+    Documents live in memory, at most `max_entries` of them, and on disk, in
+    directory `.responses` of `cache_dir` (if given), using at most `max_bytes`
+    bytes; both tiers evict least recently used entries first and drop entries
+    older than `ttl` seconds. Counters in `stats` track hits, misses and evictions.
+    """
+
+    def __init__(self, cache_dir=None, ttl=24*60*60, max_entries=256, max_bytes=64*2**20):
+        self.directory = os.path.join(cache_dir, RESPONSES_DIRNAME) if cache_dir else None
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()
+        self.stats = Counter()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def filename(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, payload):
+        """
+        Return the cached document for `payload`, or `None`.
+        """
+        key, now = payload_key(payload), time.time()
+
+        if key in self.memory:
+            stored, doc = self.memory[key]
+            if now - stored <= self.ttl:
+                self.memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return doc
+            del self.memory[key]
+            self.stats['expirations'] += 1
+
+        if self.directory:
+            with suppress(FileNotFoundError, ValueError):
+                with open(self.filename(key), 'r') as f:
+                    entry = json.load(f)
+                if now - entry['stored'] <= self.ttl:
+                    os.utime(self.filename(key)) # recency for eviction
+                    self.remember(key, entry['stored'], entry['doc'])
+                    self.stats['disk_hits'] += 1
+                    return entry['doc']
+                os.remove(self.filename(key))
+                self.stats['expirations'] += 1
+
+        self.stats['misses'] += 1
+        return None
+
+    def remember(self, key, stored, doc):
+        self.memory[key] = (stored, doc)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.stats['memory_evictions'] += 1
+
+    def put(self, payload, doc):
+        key, now = payload_key(payload), time.time()
+        self.remember(key, now, doc)
+
+        if self.directory:
+            with open(self.filename(key), 'w') as f:
+                json.dump({'payload': payload, 'stored': now, 'doc': doc}, f)
+            self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used files until the disk tier fits in `max_bytes`.
+        """
+        with os.scandir(self.directory) as entries:
+            files = [(e.stat().st_mtime, e.stat().st_size, e.path) for e in entries if e.is_file()]
+
+        used = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if used <= self.max_bytes: break
+            with suppress(FileNotFoundError):
+                os.remove(path)
+            used -= size
+            self.stats['disk_evictions'] += 1
+
+    def clear(self):
+        self.memory.clear()
+        if self.directory:
+            for filename in os.listdir(self.directory):
+                os.remove(os.path.join(self.directory, filename))
+
+# }}}
+
+# argument parsing {{{
+
+def handle_cli_arguments():
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='OEIS cache storage.')
+
+    parser.add_argument("--cache-dir", help="Cache directory (defaults to ./fetched/)",
+                        default='./fetched/')
+    parser.add_argument("--migrate", help="Convert the cache to layout M (one file per sequence or compressed packs)",
+                        metavar='M', choices=['directory', 'packed'])
+    parser.add_argument("--compact", help="Drop outdated documents from packs (defaults to False)",
+                        action="store_true", default=False)
+
+    args = parser.parse_args()
+    return args
+
+# }}}
+
+# main {{{
+
+if __name__ == "__main__":
+
+    args = handle_cli_arguments()
+
+    if args.migrate:
+        migrated = migrate(args.cache_dir, to=args.migrate)
+        print('{} sequences migrated to {} layout in cache {}'.format(migrated, args.migrate, args.cache_dir))
+
+    storage = open_storage(args.cache_dir)
+
+    if args.compact and isinstance(storage, packed_storage):
+        storage.compact()
+
+    print('{} sequences stored by {} in cache {}'.format(
+        len(storage.ids()), type(storage).__name__, args.cache_dir))
+
+# }}}
@@ -0,0 +1,4 @@
+import os, sys
+
+# modules of the repository are scripts in `src/`, importing each other by name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
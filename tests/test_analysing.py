@@ -0,0 +1,33 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+from graphing import compact_graph
+from indexing import COUNTED_FIELDS
+from analysing import hits, pagerank
+
+def random_graph(n, references, seed=0):
+    """
+    Return a `compact_graph` of `n` sequences, each referencing about `references` random others.
+    """
+    rng = np.random.default_rng(seed)
+    ids = ['A{:06d}'.format(i) for i in range(1, n + 1)]
+    counts = (0,) * len(COUNTED_FIELDS)
+    return compact_graph.from_adjacency({
+        seq_id: ('', counts, sorted(set(ids[j] for j in rng.integers(0, n, rng.poisson(references)))))
+        for seq_id in ids})
+
+@pytest.mark.parametrize('n', [10, 3000])
+def test_hits_agrees_with_networkx(n):
+    graph = random_graph(n, references=3)
+    hubs, authorities = hits(graph)
+    nx_hubs, nx_authorities = nx.hits(graph.to_networkx(digraph=True))
+
+    assert np.allclose(hubs.values, [nx_hubs[seq_id] for seq_id in graph.ids.tolist()], atol=1e-8)
+    assert np.allclose(authorities.values, [nx_authorities[seq_id] for seq_id in graph.ids.tolist()], atol=1e-8)
+    assert hubs.values.sum() == pytest.approx(1) and authorities.values.sum() == pytest.approx(1)
+
+def test_pagerank_agrees_with_networkx():
+    graph = random_graph(3000, references=3)
+    nx_ranks = nx.pagerank(graph.to_networkx(digraph=True))
+    assert np.allclose(pagerank(graph).values, [nx_ranks[seq_id] for seq_id in graph.ids.tolist()], atol=1e-6)
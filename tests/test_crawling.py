@@ -0,0 +1,88 @@
+import asyncio
+
+import crawling
+
+def serve_once_per_connection():
+    """
+    Start a server answering the first request of each connection only: later
+    ones are never answered, as by a server that forgot a kept-alive connection.
+    """
+    connections = []
+
+    async def handle(reader, writer):
+        connections.append(writer)
+        await reader.readuntil(b'\r\n\r\n')
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+        await writer.drain()
+        await reader.read() # the connection stays open, silently
+
+    server = crawling.loop.run_until_complete(asyncio.start_server(handle, '127.0.0.1', 0))
+    return server, server.sockets[0].getsockname()[1], connections
+
+def test_forgotten_keep_alive_connection_is_retried_on_a_fresh_one():
+    server, port, connections = serve_once_per_connection()
+    pool = crawling.connection_pool(timeout=0.5)
+    bodies = []
+
+    def fetch(resource):
+        f = crawling.fetcher(crawling.URL(host='127.0.0.1', port=port, resource=resource),
+                             done=lambda url, content: bodies.append(bytes(content)), pool=pool)
+        crawling.loop.run_until_complete(asyncio.wait_for(f.fetch(), 5))
+
+    try:
+        fetch('/first')
+        assert len(pool.idle[('127.0.0.1', port)]) == 1
+
+        fetch('/second') # times out on the kept-alive connection, then succeeds on a new one
+        assert bodies == [b'ok', b'ok']
+        assert len(connections) == 2
+    finally:
+        pool.close()
+        server.close()
+
+def test_pipelined_requests_on_a_forgotten_connection_are_fetched_again():
+    server, port, connections = serve_once_per_connection()
+    pool = crawling.connection_pool(timeout=0.5)
+    bodies = []
+
+    def fetchers(*resources):
+        return [crawling.fetcher(crawling.URL(host='127.0.0.1', port=port, resource=resource),
+                                 done=lambda url, content: bodies.append(url.resource), pool=pool)
+                for resource in resources]
+
+    try:
+        crawling.loop.run_until_complete(fetchers('/first')[0].fetch())
+        crawling.loop.run_until_complete(asyncio.wait_for(crawling.fetch_pipelined(fetchers('/second', '/third')), 5))
+        assert bodies == ['/first', '/second', '/third']
+        assert len(connections) == 3
+    finally:
+        pool.close()
+        server.close()
+
+def test_resource_without_fetcher_is_given_up_and_the_crawl_goes_on():
+    async def handle(reader, writer):
+        while await reader.readuntil(b'\r\n\r\n'):
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+            await writer.drain()
+
+    server = crawling.loop.run_until_complete(asyncio.start_server(handle, '127.0.0.1', 0))
+    port = server.sockets[0].getsockname()[1]
+    pool = crawling.connection_pool(timeout=0.5)
+    fetched, dead = [], {}
+
+    def factory(resource, appender, retry):
+        if resource == '/bad': raise ValueError('no URL for {}'.format(resource))
+        return crawling.fetcher(crawling.URL(host='127.0.0.1', port=port, resource=resource),
+                                done=lambda url, content: fetched.append(url.resource), pool=pool)
+
+    frontier = crawling.priority_frontier()
+    retry = crawling.retry_scheduler(frontier, gave_up=lambda resource, reason: dead.update({resource: reason}))
+    job = crawling.crawler(['/a', '/bad', '/c'], factory, max_tasks=1, frontier=frontier, retry=retry)
+
+    try:
+        crawling.loop.run_until_complete(asyncio.wait_for(job.crawl(), 5))
+        assert sorted(fetched) == ['/a', '/c']
+        assert list(dead) == ['/bad'] and isinstance(dead['/bad'], ValueError)
+    finally:
+        pool.close()
+        server.close()
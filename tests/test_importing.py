@@ -0,0 +1,65 @@
+import pytest
+
+from commons import open_index
+from importing import bulk_import
+from storing import open_storage
+
+STRIPPED = '''# OEIS stripped dump
+A000045 ,0,1,1,2,3,5,8,
+A000108 ,1,1,2,5,14,42,
+'''
+
+NAMES = '''# OEIS names dump
+A000045 Fibonacci numbers.
+A000108 Catalan numbers.
+'''
+
+@pytest.fixture
+def dumps(tmp_path):
+    (tmp_path / 'stripped').write_text(STRIPPED)
+    (tmp_path / 'names').write_text(NAMES)
+    cache_dir = tmp_path / 'cache'
+    cache_dir.mkdir()
+    return str(cache_dir), str(tmp_path / 'stripped'), str(tmp_path / 'names')
+
+def result_of(cache_dir, seq_id):
+    return open_storage(cache_dir).get(seq_id)['results'][0]
+
+@pytest.mark.parametrize('first', ['stripped', 'names'])
+def test_successive_imports_merge_partial_documents(dumps, first):
+    cache_dir, stripped, names = dumps
+    if first == 'stripped':
+        bulk_import(cache_dir, stripped=stripped)
+        bulk_import(cache_dir, names=names)
+    else:
+        bulk_import(cache_dir, names=names)
+        bulk_import(cache_dir, stripped=stripped)
+
+    result = result_of(cache_dir, 'A000045')
+    assert result['data'] == '0,1,1,2,3,5,8'
+    assert result['name'] == 'Fibonacci numbers.'
+    assert open_storage(cache_dir).get('A000045')['partial']
+
+    index = open_index(cache_dir)
+    assert list(index.terms['A000108']) == [1, 1, 2, 5, 14, 42]
+    assert index.search_text('catalan') == ['A000108']
+
+def test_import_keeps_documents_fetched_in_full(dumps):
+    cache_dir, stripped, names = dumps
+    full = {'results': [{'number': 45, 'name': 'Fibonacci numbers: F(n) = F(n-1) + F(n-2).',
+                         'data': '0,1,1,2,3,5,8,13', 'keyword': 'core,nice'}]}
+    open_storage(cache_dir).put('A000045', full)
+
+    assert bulk_import(cache_dir, stripped=stripped, names=names) == (1, 1)
+    assert open_storage(cache_dir).get('A000045') == full
+
+def test_imported_partial_documents_are_stale_however_recent(dumps):
+    cache_dir, stripped, names = dumps
+    full = {'results': [{'number': 142, 'name': 'Factorial numbers.', 'data': '1,1,2,6,24',
+                         'time': '2020-01-01T00:00:00-05:00'}]}
+    open_storage(cache_dir).put('A000142', full)
+    bulk_import(cache_dir, stripped=stripped, names=names)
+
+    index = open_index(cache_dir)
+    assert index.stale(older_than=30 * 86400) == ['A000045', 'A000108']
+    assert index.stale(older_than=30 * 86400, revised_before='2021-01-01') == ['A000045', 'A000108']